@@ -0,0 +1,39 @@
+"""Overhead of recording function arguments, per 10000 calls."""
+import reproducible
+
+
+N_CALLS = 10000
+
+
+def _deep(depth, func):
+    """Call `func` at the bottom of a stack of `depth` frames."""
+    return func() if depth == 0 else _deep(depth - 1, func)
+
+
+def bench_function_args(tmp_dir):
+    def step(i, lr=0.1, momentum=0.9):
+        return reproducible.function_args()
+    def calls():
+        for i in range(N_CALLS):
+            step(i)
+    return lambda: _deep(50, calls)
+
+def bench_record_calls(tmp_dir):
+    context = reproducible.Context()
+    @context.record_calls(maxlen=1000)
+    def step(i, lr=0.1, momentum=0.9):
+        return i
+    def calls():
+        for i in range(N_CALLS):
+            step(i)
+    return calls
+
+def bench_record_calls_sampled(tmp_dir):
+    context = reproducible.Context()
+    @context.record_calls(maxlen=1000, every=100)
+    def step(i, lr=0.1, momentum=0.9):
+        return i
+    def calls():
+        for i in range(N_CALLS):
+            step(i)
+    return calls
@@ -0,0 +1,19 @@
+"""Creation of `Context` instances, and collection of the environment."""
+import reproducible
+
+from reproducible.reproducible import _installed_packages
+
+
+def bench_context(tmp_dir):
+    return reproducible.Context
+
+def bench_context_cpuinfo(tmp_dir):
+    """CPU info, cached until the next reboot."""
+    return lambda: reproducible.Context(cpuinfo=True)
+
+def bench_context_pip_packages(tmp_dir):
+    """Installed packages, cached until a package is installed or removed."""
+    return lambda: reproducible.Context(pip_packages=True)
+
+def bench_installed_packages_uncached(tmp_dir):
+    return lambda: _installed_packages(cache=False)
@@ -0,0 +1,38 @@
+"""Export time and size of records, as they grow."""
+import os
+
+from fixtures import params, make_context
+
+
+SIZES = [100, 10000, 100000]
+
+
+def _export(tmp_dir, n_files, method, filename, **kwargs):
+    context = make_context(n_files)
+    path = os.path.join(tmp_dir, filename)
+    def export():
+        getattr(context, method)(path, **kwargs)
+        return {'size': os.path.getsize(path)}
+    return export
+
+@params('n_files', SIZES)
+def bench_export_json(tmp_dir, n_files):
+    return _export(tmp_dir, n_files, 'export_json', 'record.json')
+
+@params('n_files', SIZES[:2])
+def bench_export_yaml(tmp_dir, n_files):
+    return _export(tmp_dir, n_files, 'export_yaml', 'record.yaml')
+
+@params('n_files', SIZES)
+def bench_export_msgpack(tmp_dir, n_files):
+    return _export(tmp_dir, n_files, 'export_msgpack', 'record.msgpack',
+                   compression=None)
+
+@params('n_files', SIZES[:2])
+def bench_export_msgpack_xz(tmp_dir, n_files):
+    return _export(tmp_dir, n_files, 'export_msgpack', 'record.msgpack.xz')
+
+@params('n_files', SIZES)
+def bench_digest(tmp_dir, n_files):
+    context = make_context(n_files)
+    return context.digest
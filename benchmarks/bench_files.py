@@ -0,0 +1,49 @@
+"""Hashing of files, file lists and directory trees."""
+import os
+
+import reproducible
+
+from fixtures import KB, MB, GB, params, make_file, make_tree
+
+
+@params('size', [KB, MB, 64 * MB], large=[GB, 10 * GB])
+def bench_add_file(tmp_dir, size):
+    path = make_file(os.path.join(tmp_dir, 'data.bin'), size)
+    context = reproducible.Context()
+    def add_file():
+        context.add_file(path)
+        return {'bytes': size}
+    return add_file
+
+@params('size', [MB, 64 * MB])
+def bench_add_file_hash_cache(tmp_dir, size):
+    """Files that were hashed before, and not modified since."""
+    path = make_file(os.path.join(tmp_dir, 'data.bin'), size)
+    context = reproducible.Context(
+                  hash_cache=os.path.join(tmp_dir, 'hashes.sqlite'))
+    return lambda: context.add_file(path)
+
+@params('n_files', [100, 1000])
+def bench_add_files(tmp_dir, n_files):
+    paths = make_tree(os.path.join(tmp_dir, 'tree'), n_files, file_size=16 * KB)
+    context = reproducible.Context()
+    def add_files():
+        context.add_files(paths)
+        return {'bytes': n_files * 16 * KB}
+    return add_files
+
+@params('n_files', [1000, 10000])
+def bench_add_directory(tmp_dir, n_files):
+    root = os.path.join(tmp_dir, 'tree')
+    make_tree(root, n_files, file_size=KB)
+    context = reproducible.Context()
+    return lambda: context.add_directory(root)
+
+@params('n_files', [1000, 10000])
+def bench_add_directory_manifest(tmp_dir, n_files):
+    """Unmodified directories, with an up-to-date manifest."""
+    root = os.path.join(tmp_dir, 'tree')
+    make_tree(root, n_files, file_size=KB)
+    manifest = os.path.join(tmp_dir, 'manifest.json')
+    context = reproducible.Context()
+    return lambda: context.add_directory(root, manifest=manifest)
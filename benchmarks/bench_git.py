@@ -0,0 +1,26 @@
+"""Queries of git repositories, with uncommitted changes."""
+import os
+
+import reproducible
+
+from fixtures import params, make_repo
+
+
+@params('n_files', [1000, 10000])
+def bench_git_info(tmp_dir, n_files):
+    path = make_repo(os.path.join(tmp_dir, 'repo'), n_files=n_files)
+    def git_info():
+        reproducible.git_info(path)
+    return git_info
+
+@params('n_files', [1000, 10000])
+def bench_git_dirty(tmp_dir, n_files):
+    path = make_repo(os.path.join(tmp_dir, 'repo'), n_files=n_files)
+    return lambda: reproducible.git_dirty(path)
+
+@params('n_files', [1000, 10000])
+def bench_add_repo_store(tmp_dir, n_files):
+    """Diffs stored out-of-line, gzip-compressed."""
+    path = make_repo(os.path.join(tmp_dir, 'repo'), n_files=n_files)
+    context = reproducible.Context(store=os.path.join(tmp_dir, 'store'))
+    return lambda: context.add_repo(path, allow_dirty=True)
@@ -0,0 +1,109 @@
+"""Fixtures of the benchmarks: files, file trees, git repositories and records.
+
+All fixtures are generated in the temporary directory given to each benchmark,
+and are deterministic, so that the benchmarks measure the same work from one
+run to the next.
+"""
+import os
+import random
+import subprocess
+
+import reproducible
+
+
+KB, MB, GB = 1024, 1024**2, 1024**3
+
+
+def params(name, values, large=()):
+    """Declare a parameter of a benchmark.
+
+    The benchmark is run once for each value of `values`, and, with the
+    `--large` option of `run.py`, of `large`.
+    """
+    def decorator(func):
+        func.params = (name, list(values), list(large))
+        return func
+    return decorator
+
+
+def size_label(size):
+    for unit, label in ((GB, 'GB'), (MB, 'MB'), (KB, 'KB')):
+        if size >= unit and size % unit == 0:
+            return '{}{}'.format(size // unit, label)
+    return str(size)
+
+
+def make_file(path, size):
+    """Create a file of `size` bytes of pseudo-random content."""
+    block = random.Random(size).getrandbits(8 * MB).to_bytes(MB, 'little')
+    with open(path, 'wb') as f:
+        for _ in range(size // MB):
+            f.write(block)
+        f.write(block[:size % MB])
+    return path
+
+
+def make_tree(root, n_files, file_size=KB, fanout=10, text=False):
+    """Create a tree of `n_files` files, `fanout` files or directories per
+    directory. If `text` is True, the files are text files."""
+    paths = []
+    for i in range(n_files):
+        parts, j = [], i // fanout
+        while j:
+            parts.append('d{}'.format(j % fanout))
+            j //= fanout
+        directory = os.path.join(root, *reversed(parts))
+        os.makedirs(directory, exist_ok=True)
+        paths.append(os.path.join(directory, 'f{}.bin'.format(i)))
+        with open(paths[-1], 'wb') as f:
+            if text:
+                f.write('line {:>10}\n'.format(i).encode() * (file_size // 16))
+            else:
+                f.write(i.to_bytes(8, 'little') * (file_size // 8))
+    return paths
+
+
+def _git(path, *args):
+    subprocess.check_output(('git', '-c', 'user.name=bench',
+                             '-c', 'user.email=bench@example.com') + args,
+                            cwd=path)
+
+def make_repo(path, n_files=1000, n_commits=5, n_modified=20, n_untracked=20):
+    """Create a git repository, with `n_files` tracked files over `n_commits`
+    commits, and uncommitted changes: `n_modified` modified files and
+    `n_untracked` untracked files."""
+    os.makedirs(path, exist_ok=True)
+    _git(path, 'init', '-q')
+    paths = make_tree(path, n_files, file_size=256, text=True)
+    per_commit = max(1, n_files // n_commits)
+    for start in range(0, n_files, per_commit):
+        _git(path, 'add', *paths[start:start + per_commit])
+        _git(path, 'commit', '-q', '-m', 'files from {}'.format(start))
+    for filepath in paths[:n_modified]:
+        with open(filepath, 'a') as f:
+            f.write('modified\n')
+    for i in range(n_untracked):
+        with open(os.path.join(path, 'untracked{}.txt'.format(i)), 'w') as f:
+            f.write('untracked\n')
+    return path
+
+
+def make_context(n_files, n_data=100):
+    """Return a `Context` whose data looks like a large record: the basic
+    data, `n_files` tracked files in a few categories, and `n_data` user data
+    entries."""
+    context = reproducible.Context()
+    rng = random.Random(n_files)
+    files = {}
+    for i in range(n_files):
+        category = ('input', 'output', 'checkpoint')[i % 3]
+        files.setdefault(category, {})['run/{}/file{}.bin'.format(category, i)] = {
+            'sha256': '{:064x}'.format(rng.getrandbits(256)),
+            'mtime': 1.6e9 + i, 'size': rng.randrange(10**9)}
+    context.data['files'] = files
+    context.data['data'] = {'param{}'.format(i): {'value': rng.random(),
+                                                   'values': list(range(10))}
+                            for i in range(n_data)}
+    context.data['packages'] = ['package{}=={}.0'.format(i, i)
+                                for i in range(200)]
+    return context
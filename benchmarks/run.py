@@ -0,0 +1,154 @@
+"""Run the benchmarks of reproducible.
+
+    $ python benchmarks/run.py                       # run all benchmarks
+    $ python benchmarks/run.py -k export --repeat 10
+    $ python benchmarks/run.py --save baseline.json  # e.g. on the main branch
+    $ python benchmarks/run.py --compare baseline.json
+
+Benchmarks are the `bench_*` functions of the `bench_*.py` modules of this
+directory. Each one receives a temporary directory, where it creates its
+fixtures (see `fixtures.py`), and, if it is parametrized, a parameter value.
+It returns the function to time. If that function returns a dictionary, it is
+reported along with the time: e.g. the size of an export, or the number of
+`bytes` processed, from which a throughput is computed.
+
+With `--compare`, the minimum times are compared with those of a baseline
+saved with `--save`, and the exit status is 1 if a benchmark is slower than
+the baseline by more than the `--threshold` ratio.
+"""
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import importlib
+import statistics
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(1, os.path.dirname(here))
+
+import reproducible
+from fixtures import size_label
+
+
+def collect(pattern=None, large=False):
+    """Return the benchmarks, as a list of `(name, func, param)`."""
+    benchmarks = []
+    for filename in sorted(os.listdir(here)):
+        if not (filename.startswith('bench_') and filename.endswith('.py')):
+            continue
+        module = importlib.import_module(filename[:-3])
+        for attr in sorted(vars(module)):
+            func = getattr(module, attr)
+            if not (attr.startswith('bench_') and callable(func)):
+                continue
+            name = '{}.{}'.format(module.__name__, attr)
+            if not hasattr(func, 'params'):
+                benchmarks.append((name, func, None))
+                continue
+            param_name, values, large_values = func.params
+            for value in values + (large_values if large else []):
+                label = size_label(value) if isinstance(value, int) else value
+                benchmarks.append(('{}[{}={}]'.format(name, param_name, label),
+                                   func, value))
+    if pattern is not None:
+        benchmarks = [b for b in benchmarks
+                      if fnmatch.fnmatch(b[0], '*{}*'.format(pattern))]
+    return benchmarks
+
+
+def run(func, param, repeat):
+    """Run a benchmark, and return its result."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        timed = func(tmp_dir) if param is None else func(tmp_dir, param)
+        extra = timed()  # warm-up
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extra = timed()
+            times.append(time.perf_counter() - start)
+    result = {'min': min(times), 'median': statistics.median(times),
+              'repeat': repeat}
+    if isinstance(extra, dict):
+        result['extra'] = extra
+    return result
+
+
+def format_result(name, result):
+    line = '{:<60} {:>10.3f} ms {:>10.3f} ms'.format(
+               name, result['min'] * 1e3, result['median'] * 1e3)
+    extra = dict(result.get('extra', {}))
+    if 'bytes' in extra:
+        line += '  {:>8.1f} MB/s'.format(extra.pop('bytes') / result['min'] / 1e6)
+    for key, value in sorted(extra.items()):
+        line += '  {}={}'.format(key, value)
+    return line
+
+
+def compare(results, baseline, threshold):
+    """Print the comparison with the baseline, and return the names of the
+    benchmarks that regressed."""
+    regressions = []
+    print('\n{:<60} {:>13} {:>13} {:>7}'.format('benchmark', 'baseline',
+                                                'current', 'ratio'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['min'] / baseline[name]['min']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = '  improvement'
+        print('{:<60} {:>10.3f} ms {:>10.3f} ms {:>7.2f}{}'.format(
+                  name, baseline[name]['min'] * 1e3, result['min'] * 1e3,
+                  ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmarks of reproducible.')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run the benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs of each benchmark')
+    parser.add_argument('--large', action='store_true',
+                        help='also run the large variants (GB-sized files)')
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help='save the results, to serve as a baseline')
+    parser.add_argument('--compare', metavar='FILE', default=None,
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = {}
+    print('{:<60} {:>13} {:>13}'.format('benchmark', 'min', 'median'))
+    for name, func, param in collect(args.pattern, large=args.large):
+        results[name] = run(func, param, args.repeat)
+        print(format_result(name, results[name]), flush=True)
+
+    if args.save is not None:
+        # the benchmarks are themselves recorded with reproducible.
+        context = reproducible.Context(cpuinfo=True)
+        context.add_repo(os.path.dirname(here), allow_dirty=True, diff=False)
+        context.add_data('results', results)
+        context.export_json(args.save)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['data']['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\n{} regression(s) above {:.0%}'.format(len(regressions),
+                                                        args.threshold - 1))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
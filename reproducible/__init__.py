@@ -1,40 +1,74 @@
 __version__ = '0.4.1'
 
-from .reproducible import Context
+import sys
 
-# Create one instance and export its methods as module-level functions,
-# similarly to the `random` standart module.
-_context = Context()
+from .reproducible import (Context, RepositoryNotFound, RepositoryDirty,
+                           MergeConflict, VerificationReport)
+from .cache import HashCache, ResultCache
+from .index import Index
+from .comparison import RecordDiff, Change
 
-reset            = _context.reset
-data             = _context.data
+# One instance is created and its methods exported as module-level functions,
+# similarly to the `random` standart module. The instance is only created the
+# first time one of the module-level functions is accessed, so that importing
+# reproducible stays cheap.
+_exported = (
+    'reset', 'data',
 
-function_args    = _context.function_args
+    'function_args', 'memoize', 'record_calls',
 
-add_repo         = _context.add_repo
-add_file         = _context.add_file
-untrack_file     = _context.untrack_file
-add_data         = _context.add_data
-add_random_state = _context.add_random_state
-add_pip_packages = _context.add_pip_packages
-add_cpu_info     = _context.add_cpu_info
+    'add_repo', 'add_file', 'add_files', 'add_directory', 'untrack_file',
+    'add_data', 'add_random_state', 'add_pip_packages', 'add_cpu_info',
+    'restore_random_state', 'load_array',
 
-find_editable_repos = _context.find_editable_repos
-add_editable_repos  = _context.add_editable_repos
+    'find_editable_repos', 'add_editable_repos',
 
-json                = _context.json
-yaml                = _context.yaml
-requirements        = _context.requirements
-export_json         = _context.export_json
-export_yaml         = _context.export_yaml
-export_requirements = _context.export_requirements
+    'json', 'yaml', 'msgpack', 'requirements', 'digest',
+    'export_json', 'export_yaml', 'export_msgpack', 'export_requirements',
+    'load_msgpack', 'load',
 
-git_info         = _context.git_info
-git_dirty        = _context.git_dirty
+    'compare',
 
-sha256           = _context.sha256
+    'fork', 'merge',
 
+    'add_profile_hook', 'remove_profile_hook',
 
-# Deprecated, will be removed in a future version
-save_json        = _context.save_json
-save_yaml        = _context.save_yaml
+    'open_journal', 'close_journal', 'load_journal', 'compact_journal',
+
+    'git_info', 'git_dirty', 'git_snapshot',
+
+    'aadd_file', 'aadd_files', 'aadd_repo', 'aadd_pip_packages',
+    'aexport_json', 'aexport_yaml', 'aexport_msgpack', 'agit_snapshot',
+
+    'sha256', 'verify',
+
+    # Deprecated, will be removed in a future version
+    'save_json', 'save_yaml',
+)
+
+_context = None
+
+def _default_context():
+    global _context
+    if _context is None:
+        _context = Context()
+    return _context
+
+def __getattr__(name):
+    if name in _exported:
+        value = getattr(_default_context(), name)
+        if name != 'data':  # `reset()` replaces the data dictionary.
+            globals()[name] = value
+        return value
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__,
+                                                                      name))
+
+def __dir__():
+    return sorted(set(globals()).union(_exported))
+
+
+if sys.version_info < (3, 7):  # no module-level __getattr__ (PEP 562)
+    for _name in _exported:
+        if _name != 'data':
+            globals()[_name] = getattr(_default_context(), _name)
+    data = _context.data
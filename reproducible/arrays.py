@@ -0,0 +1,113 @@
+"""Out-of-line storage of arrays, in a content-addressed store of `.npy` files.
+
+Arrays are written in the `arrays` subdirectory of the store, under the name
+`<sha256>.npy`, where `<sha256>` is the digest of the file, and are replaced in
+the tracked data by a dictionary with their `sha256`, `dtype`, `shape`, `size`
+and `path`. An array is written only once, however many times it is recorded.
+
+Both numpy arrays and objects supporting the buffer protocol, such as `bytes`,
+`bytearray`, `memoryview` or `array.array`, are supported. The `.npy` files
+are written without numpy, so that buffers can be stored even if numpy is not
+installed; numpy is needed to load them back.
+"""
+import os
+import sys
+import struct
+import hashlib
+
+from .atomic import AtomicWriter
+
+
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# kinds of the numpy dtypes matching the `struct` formats of buffers.
+_FORMAT_KINDS = {'b': 'i', 'h': 'i', 'i': 'i', 'l': 'i', 'q': 'i',
+                 'B': 'u', 'H': 'u', 'I': 'u', 'L': 'u', 'Q': 'u',
+                 'e': 'f', 'f': 'f', 'd': 'f', '?': 'b'}
+
+
+def _buffer_info(obj):
+    """Return `(descr, fortran_order, shape, nbytes, data)` for an array or a
+    buffer, where `data` is a memoryview of the contiguous bytes of the array,
+    or None if the object is not supported."""
+    if type(obj).__module__.split('.')[0] == 'numpy' and hasattr(obj, 'dtype'):
+        if obj.dtype.hasobject or obj.ndim == 0:
+            return None
+        import numpy
+        fortran_order = obj.flags.f_contiguous and not obj.flags.c_contiguous
+        flat = obj.T if fortran_order else numpy.ascontiguousarray(obj)
+        data = memoryview(flat.reshape(-1).view(numpy.uint8))
+        return (numpy.lib.format.dtype_to_descr(obj.dtype), fortran_order,
+                obj.shape, obj.nbytes, data)
+    if isinstance(obj, str):
+        return None
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        return None
+    kind = _FORMAT_KINDS.get(view.format.lstrip('@='))
+    if kind is None or not view.contiguous:
+        return None
+    byteorder = '|' if view.itemsize == 1 else ('<' if sys.byteorder == 'little'
+                                                else '>')
+    return ('{}{}{}'.format(byteorder, kind, view.itemsize), False, view.shape,
+            view.nbytes, view.cast('B'))
+
+
+def _npy_header(descr, fortran_order, shape):
+    """Return the header of a version 1.0 `.npy` file."""
+    header = "{{'descr': {!r}, 'fortran_order': {}, 'shape': {!r}, }}".format(
+                 descr, fortran_order, tuple(shape))
+    # the data is aligned on 64 bytes, and the header ends with a newline.
+    padding = 64 - (len(_NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * (padding % 64) + '\n').encode('latin1')
+    return _NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+def store_array(store, obj, threshold=0):
+    """Write an array in the store, if it is not there already.
+
+    :param store:      directory of the store.
+    :param obj:        a numpy array, or an object supporting the buffer
+                       protocol.
+    :param threshold:  arrays of this size, in bytes, or smaller, are not
+                       stored.
+    :return:  the dictionary describing the stored array, or None if the
+              object is not a supported array, or is too small.
+    """
+    info = _buffer_info(obj)
+    if info is None or info[3] <= threshold:
+        return None
+    descr, fortran_order, shape, nbytes, data = info
+    header = _npy_header(descr, fortran_order, shape)
+    digest = hashlib.sha256(header)
+    digest.update(data)
+    digest = digest.hexdigest()
+
+    directory = os.path.join(store, 'arrays')
+    path = os.path.join(directory, '{}.npy'.format(digest))
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        with AtomicWriter(path, hashed=False) as f:
+            f.write(header)
+            f.write(data)
+    return {'__type__': 'array', 'sha256': digest, 'dtype': str(descr),
+            'shape': list(shape), 'size': nbytes, 'path': path}
+
+
+def store_arrays(store, data, threshold=0):
+    """Return `data` with the arrays it contains, directly or in dictionaries,
+    lists and tuples, replaced by their description. See `store_array`."""
+    entry = store_array(store, data, threshold=threshold)
+    if entry is not None:
+        return entry
+    if isinstance(data, dict):
+        return {key: store_arrays(store, value, threshold)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return type(data)(store_arrays(store, value, threshold) for value in data)
+    return data
+
+
+def is_array_entry(value):
+    """Return True if `value` describes an array written by `store_array`."""
+    return isinstance(value, dict) and value.get('__type__') == 'array'
@@ -0,0 +1,85 @@
+"""Atomic writes of the files of records and stores.
+
+The content is written in a temporary file, in the directory of the
+destination, which is synced to disk and renamed to the destination once
+complete, so that readers never see a partially written file. On error, the
+temporary file is removed. Unlike `tempfile.mkstemp`, the temporary file is
+created with the permissions allowed by the umask, so that a shared store is
+readable by other users.
+"""
+import os
+import hashlib
+
+
+class AtomicWriter:
+    """Writable file that computes the SHA256 of its content as it is written,
+    and that atomically replaces `path` once complete.
+
+    The digest is available in the `sha256` attribute once the writer is
+    closed without error.
+
+    :param path:      path of the file to write. It may be overridden when
+                      closing, for content-addressed files.
+    :param encoding:  if not None, `write` accepts strings, encoded with it.
+    :param hashed:    if False, the digest of the content is not computed,
+                      e.g. when the caller computes it already.
+    """
+
+    def __init__(self, path, encoding=None, hashed=True):
+        self.path     = path
+        self.encoding = encoding
+        self.sha256   = None
+        self._hash    = hashlib.sha256() if hashed else None
+        self._tmp_path = '{}.{}.tmp'.format(path, os.urandom(4).hex())
+        fd = os.open(self._tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self._file = os.fdopen(fd, 'wb')
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, data):
+        if self.encoding is not None:
+            data = data.encode(self.encoding)
+        if self._hash is not None:
+            self._hash.update(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self, path=None):
+        """Sync the content to disk and move it to its destination.
+
+        :param path:  if not None, the destination, instead of the path given
+                      to the constructor. It must be in the same directory.
+        """
+        if path is not None:
+            self.path = path
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._tmp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        if self._hash is not None:
+            self.sha256 = self._hash.hexdigest()
+
+    def abort(self):
+        """Discard the content written so far."""
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
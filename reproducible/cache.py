@@ -0,0 +1,401 @@
+"""Persistent, on-disk caches used by reproducible.
+
+The caches live by default under `~/.cache/reproducible` (or
+`$XDG_CACHE_HOME/reproducible`). The `REPRODUCIBLE_CACHE_DIR` environment
+variable overrides that location.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import pickle
+import hashlib
+import sqlite3
+import threading
+
+
+def cache_dir():
+    """Return the directory where reproducible stores its caches.
+
+    The directory is not created by this function.
+    """
+    path = os.environ.get('REPRODUCIBLE_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+                                              os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'reproducible')
+
+
+def stat_key(st):
+    """Return the cache key of a file from its `os.stat` result.
+
+    The key identifies a specific version of a specific file: if the file is
+    modified, replaced or touched, at least one of the fields changes.
+    """
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+
+def read_cache_file(filename, key):
+    """Return the value stored in a JSON cache file, or None.
+
+    None is also returned if the file cannot be read, or if the value was
+    stored under a different key.
+
+    :param filename:  name of the file, in the cache directory.
+    :param key:       JSON-serializable key the value was stored with.
+    """
+    try:
+        with open(os.path.join(cache_dir(), filename), 'r') as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(content, dict) or content.get('key') != key:
+        return None
+    return content.get('value')
+
+
+def write_cache_file(filename, key, value):
+    """Store a JSON-serializable value in a cache file.
+
+    The file is replaced atomically, so concurrent readers never see a
+    partially written file. Errors are ignored, as caching is only an
+    optimization.
+    """
+    path = os.path.join(cache_dir(), filename)
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': key, 'value': value}, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class _SQLiteCache:
+    """Base class of the caches indexed in a SQLite database, that can be
+    shared by many threads and processes, and pickled.
+
+    Subclasses define the `_table` holding the entries, the `_schema`
+    statements creating it, and the `_database` path.
+    """
+
+    _table  = None
+    _schema = ()
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._conn   = None
+        self._pid    = None
+        self._lock   = threading.Lock()
+
+    @property
+    def _database(self):
+        raise NotImplementedError
+
+    def _connection(self):
+        """Return the connection to the database. Must be called with the
+        lock held."""
+        # SQLite connections must not be shared across a fork.
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self._database)),
+                        exist_ok=True)
+            conn = sqlite3.connect(self._database, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.OperationalError:  # e.g. on some network filesystems
+                pass
+            for statement in self._schema:
+                conn.execute(statement)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute(
+                       'SELECT COUNT(*) FROM {}'.format(self._table)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'], state['_pid'] = None, None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class HashCache(_SQLiteCache):
+    """Persistent cache of file digests, stored in a SQLite database.
+
+    Entries are keyed by `(device, inode, size, mtime_ns, ctime_ns)`, so a
+    cached digest is only returned for a file that was not modified since it
+    was hashed. The cache is bounded: when it holds more than `max_entries`
+    entries, the least recently used ones are evicted.
+
+    The database can be shared by many processes at once: SQLite handles
+    locking, and writes that fail because the database is busy are simply
+    dropped, as the cache is only an optimization.
+
+    :param path:         path of the SQLite database. If None, `hashes.sqlite`
+                         in the reproducible cache directory is used.
+    :param max_entries:  maximum number of digests kept in the cache.
+    :param timeout:      how long to wait on a locked database, in seconds.
+    """
+
+    _table  = 'hashes'
+    _schema = ('CREATE TABLE IF NOT EXISTS hashes ('
+               ' dev INTEGER, ino INTEGER, size INTEGER,'
+               ' mtime_ns INTEGER, ctime_ns INTEGER,'
+               ' algorithm TEXT, digest TEXT, atime REAL,'
+               ' PRIMARY KEY (dev, ino, size, mtime_ns, ctime_ns,'
+               '              algorithm))',
+               'CREATE INDEX IF NOT EXISTS hashes_atime ON hashes (atime)')
+
+    def __init__(self, path=None, max_entries=100000, timeout=10.0):
+        super().__init__(timeout)
+        if path is None:
+            path = os.path.join(cache_dir(), 'hashes.sqlite')
+        self.path        = path
+        self.max_entries = max_entries
+        self._n_writes   = 0
+
+    @property
+    def _database(self):
+        return self.path
+
+    def get(self, st, algorithm='sha256'):
+        """Return the cached digest for the file with stat `st`, or None."""
+        key = stat_key(st) + (algorithm,)
+        try:
+            with self._lock:
+                return self._get(key)
+        except sqlite3.OperationalError:
+            return None
+
+    def _get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT digest FROM hashes WHERE dev=? AND ino=?'
+                           ' AND size=? AND mtime_ns=? AND ctime_ns=?'
+                           ' AND algorithm=?', key).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE hashes SET atime=? WHERE dev=? AND ino=?'
+                     ' AND size=? AND mtime_ns=? AND ctime_ns=?'
+                     ' AND algorithm=?', (time.time(),) + key)
+        return row[0]
+
+    def set(self, st, digest, algorithm='sha256'):
+        """Store the digest of the file with stat `st`."""
+        key = stat_key(st) + (algorithm,)
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute('INSERT OR REPLACE INTO hashes VALUES '
+                             '(?, ?, ?, ?, ?, ?, ?, ?)',
+                             key + (digest, time.time()))
+                # counting the rows is not free, so eviction is batched.
+                self._n_writes += 1
+                if self._n_writes % max(1, min(64, self.max_entries // 16)) == 0:
+                    self._evict(conn)
+        except sqlite3.OperationalError:
+            pass
+
+    def _evict(self, conn):
+        count = conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+        if count > self.max_entries:
+            conn.execute('DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM '
+                         'hashes ORDER BY atime LIMIT ?)',
+                         (count - self.max_entries,))
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._connection().execute('DELETE FROM hashes')
+
+
+class ResultCache(_SQLiteCache):
+    """Persistent cache of function results, used by `Context.memoize`.
+
+    Each result is pickled in its own file, in the cache directory, and the
+    sizes and last access times of the results are kept in a SQLite database
+    in the same directory. The cache is bounded: when the results take more
+    than `max_size` bytes, the least recently used ones are evicted.
+
+    As for `HashCache`, the cache can be shared by many processes, and
+    failures to read or write it are ignored.
+
+    :param path:      directory of the cache. If None, `results` in the
+                      reproducible cache directory is used.
+    :param max_size:  maximum total size of the pickled results, in bytes.
+                      Results larger than this are not cached.
+    :param timeout:   how long to wait on a locked database, in seconds.
+    """
+
+    _table  = 'results'
+    _schema = ('CREATE TABLE IF NOT EXISTS results ('
+               ' key TEXT PRIMARY KEY, size INTEGER, atime REAL)',
+               'CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+
+    def __init__(self, path=None, max_size=2**30, timeout=10.0):
+        super().__init__(timeout)
+        if path is None:
+            path = os.path.join(cache_dir(), 'results')
+        self.path     = path
+        self.max_size = max_size
+
+    @property
+    def _database(self):
+        return os.path.join(self.path, 'results.sqlite')
+
+    def _result_path(self, key):
+        return os.path.join(self.path, '{}.pickle'.format(key))
+
+    def get(self, key, default=None):
+        """Return the result stored under `key`, or `default`."""
+        try:
+            with open(self._result_path(key), 'rb') as f:
+                value = pickle.load(f)
+        except Exception:  # missing, evicted or corrupted.
+            return default
+        try:
+            with self._lock:
+                self._connection().execute(
+                    'UPDATE results SET atime=? WHERE key=?', (time.time(), key))
+        except sqlite3.OperationalError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Store a result under `key`.
+
+        :raise pickle.PicklingError:  if the result cannot be pickled.
+        """
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(content) > self.max_size:
+            return
+        path = self._result_path(key)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        try:
+            with self._lock:
+                conn = self._connection()
+                with open(tmp_path, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+                conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                             (key, len(content), time.time()))
+                self._evict(conn)
+        except (OSError, sqlite3.OperationalError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT SUM(size) FROM results').fetchone()[0] or 0
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in conn.execute('SELECT key, size FROM results '
+                                      'ORDER BY atime'):
+            if total <= self.max_size:
+                break
+            evicted.append(key)
+            total -= size
+        conn.executemany('DELETE FROM results WHERE key=?',
+                         [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._result_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all results from the cache."""
+        with self._lock:
+            conn = self._connection()
+            keys = [row[0] for row in conn.execute('SELECT key FROM results')]
+            conn.execute('DELETE FROM results')
+        for key in keys:
+            try:
+                os.remove(self._result_path(key))
+            except OSError:
+                pass
+
+
+# fields of `cpuinfo.get_cpu_info()` that vary from one call to the next.
+VOLATILE_CPUINFO_FIELDS = ('hz_actual', 'hz_actual_raw', 'hz_actual_friendly')
+
+# in-process cache of the cpu info.
+_cpu_info = None
+
+
+def _machine_key():
+    """Return a key identifying the CPUs and the current boot of the machine.
+
+    The key is computed from `/proc/cpuinfo` (ignoring the current frequency
+    of the cores) and the boot id. Return None if they are not available, as
+    is the case outside of Linux.
+    """
+    try:
+        with open('/proc/cpuinfo', 'rb') as f:
+            cpuinfo = f.read()
+        with open('/proc/sys/kernel/random/boot_id', 'rb') as f:
+            boot_id = f.read()
+    except OSError:
+        return None
+    key = hashlib.sha256(boot_id)
+    key.update(sys.version.encode())
+    for line in cpuinfo.splitlines():
+        if not line.startswith(b'cpu MHz'):
+            key.update(line)
+    return key.hexdigest()
+
+
+def cpu_info(cache=True):
+    """Return the information gathered by `cpuinfo.get_cpu_info()`.
+
+    Fields that change from one call to the next, such as the current
+    frequency of the CPU, are removed. As `get_cpu_info()` is a costly call
+    (1-2 seconds), the result is cached in memory, and, on Linux, on disk for
+    as long as the machine is not rebooted.
+
+    :param cache:  if False, the caches are neither read nor updated.
+    """
+    global _cpu_info
+    if cache and _cpu_info is not None:
+        return copy.deepcopy(_cpu_info)
+
+    key = _machine_key() if cache else None
+    filename = None
+    if key is not None:
+        filename = 'cpuinfo-{}.json'.format(key[:32])
+        _cpu_info = read_cache_file(filename, key)
+        if _cpu_info is not None:
+            return copy.deepcopy(_cpu_info)
+
+    from cpuinfo import get_cpu_info
+    info = get_cpu_info()
+    for field in VOLATILE_CPUINFO_FIELDS:
+        info.pop(field, None)
+    if not cache:
+        return info
+
+    _cpu_info = info
+    if filename is not None:
+        write_cache_file(filename, key, info)
+    return copy.deepcopy(info)
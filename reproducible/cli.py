@@ -0,0 +1,108 @@
+"""Command-line interface of reproducible.
+
+Usage examples:
+
+    $ reproducible index provenance.sqlite results/
+    $ reproducible query provenance.sqlite --file <sha256>
+    $ reproducible query provenance.sqlite --commit <hash> --dirty
+    $ reproducible verify results/run_prov.json --strict
+"""
+import sys
+import json
+import argparse
+
+from .index import Index
+from .reproducible import Context
+
+
+def _index(args):
+    with Index(args.database) as index:
+        added = index.ingest(args.paths)
+    for path, exc in index.skipped:
+        print('skipped {}: {}'.format(path, exc), file=sys.stderr)
+    print('{} record(s) added to {}'.format(added, args.database))
+
+def _query(args):
+    with Index(args.database) as index:
+        if args.sql is not None:
+            rows = index.query(args.sql)
+        elif args.file is not None:
+            rows = index.records_with_file(args.file, category=args.category)
+        elif args.commit is not None:
+            dirty = True if args.dirty else (False if args.clean else None)
+            rows = index.records_with_commit(args.commit, dirty=dirty)
+        elif args.package is not None:
+            name, _, version = args.package.partition('==')
+            rows = index.records_with_package(name, version=version or None)
+        else:
+            rows = index.query('SELECT * FROM records ORDER BY timestamp')
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        for row in rows:
+            print(row['path'] if 'path' in row else row)
+
+def _verify(args):
+    context = Context(hash_cache=None if args.strict else args.hash_cache)
+    failed = False
+    for record in args.records:
+        report = context.verify(record, strict=args.strict, workers=args.workers)
+        if len(args.records) > 1:
+            print('{}:'.format(record))
+        print(report.summary())
+        failed = failed or not report.ok
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='reproducible',
+                                     description='Work with reproducible records.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    index_parser = subparsers.add_parser('index',
+                       help='ingest records into a local index')
+    index_parser.add_argument('database', help='path of the SQLite index')
+    index_parser.add_argument('paths', nargs='+',
+                              help='record files, or directories to search')
+    index_parser.set_defaults(func=_index)
+
+    query_parser = subparsers.add_parser('query',
+                       help='find the records matching a criterion')
+    query_parser.add_argument('database', help='path of the SQLite index')
+    criteria = query_parser.add_mutually_exclusive_group()
+    criteria.add_argument('--file', metavar='SHA256',
+                          help='records that tracked a file with this digest')
+    criteria.add_argument('--commit', metavar='HASH',
+                          help='records that tracked a repository at this commit')
+    criteria.add_argument('--package', metavar='NAME[==VERSION]',
+                          help='records where this package was installed')
+    criteria.add_argument('--sql', help='arbitrary SQL query')
+    query_parser.add_argument('--category', help='category of the --file')
+    dirty = query_parser.add_mutually_exclusive_group()
+    dirty.add_argument('--dirty', action='store_true',
+                       help='with --commit, only dirty repositories')
+    dirty.add_argument('--clean', action='store_true',
+                       help='with --commit, only clean repositories')
+    query_parser.add_argument('--json', action='store_true',
+                              help='output the matching rows as JSON')
+    query_parser.set_defaults(func=_query)
+
+    verify_parser = subparsers.add_parser('verify',
+                        help='check the tracked files of records')
+    verify_parser.add_argument('records', nargs='+', help='record files')
+    verify_parser.add_argument('--strict', action='store_true',
+                               help='hash every file, even if its size and '
+                                    'mtime did not change')
+    verify_parser.add_argument('--workers', type=int, default=None,
+                               help='number of hashing threads')
+    verify_parser.add_argument('--hash-cache', default=None, metavar='PATH',
+                               help='path of a hash cache database to use')
+    verify_parser.set_defaults(func=_verify)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Structural comparison of two records of tracking data.
+
+The comparison understands the sections of the tracked data: packages are
+matched by name, files and directories by category and path, repositories by
+path, and CPU flags are compared as sets. Large values, such as random states
+or inline diffs, are reported by digest rather than by value.
+"""
+import json
+import hashlib
+from collections import namedtuple
+
+from .index import _parse_requirement
+
+
+Change = namedtuple('Change', ['section', 'key', 'kind', 'old', 'new'])
+Change.__doc__ = """A difference between two records.
+
+:param section:  top-level key of the tracked data, e.g. 'packages'.
+:param key:      what changed in the section: a package name, a
+                 `(category, path)` tuple for files, a `(path, field)` tuple
+                 for repositories, a data key, etc. None for sections compared
+                 as a whole.
+:param kind:     'added', 'removed' or 'changed'.
+:param old:      the value in the first record, None if added.
+:param new:      the value in the second record, None if removed.
+"""
+
+# sections not compared by default: they differ between identical runs.
+DEFAULT_IGNORE = ('timestamp', '_profile')
+# above this size, in characters of their JSON form, values are reported by
+# their digest.
+_MAX_VALUE_SIZE = 200
+
+
+class RecordDiff:
+    """The differences between two records, as a list of `Change`."""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __repr__(self):
+        return '<RecordDiff: {} change(s)>'.format(len(self.changes))
+
+    @property
+    def sections(self):
+        """The changes, grouped by section, as a dictionary."""
+        sections = {}
+        for change in self.changes:
+            sections.setdefault(change.section, []).append(change)
+        return sections
+
+    def section(self, name):
+        """Return the list of the changes in a section."""
+        return [change for change in self.changes if change.section == name]
+
+    def summary(self, max_changes=10):
+        """Return a human-readable summary of the differences.
+
+        :param max_changes:  maximum number of changes listed for each section.
+        """
+        if not self.changes:
+            return 'no differences'
+        lines = []
+        for section, changes in sorted(self.sections.items()):
+            counts = {}
+            for change in changes:
+                counts[change.kind] = counts.get(change.kind, 0) + 1
+            lines.append('{}: {}'.format(section, ', '.join(
+                '{} {}'.format(counts[kind], kind)
+                for kind in ('changed', 'added', 'removed') if kind in counts)))
+            for change in changes[:max_changes]:
+                key = '' if change.key is None else '{}: '.format(
+                                                            _format(change.key))
+                if change.kind == 'added':
+                    lines.append('  + {}{}'.format(key, _format(change.new)))
+                elif change.kind == 'removed':
+                    lines.append('  - {}{}'.format(key, _format(change.old)))
+                else:
+                    lines.append('  ~ {}{} -> {}'.format(key, _format(change.old),
+                                                         _format(change.new)))
+            if len(changes) > max_changes:
+                lines.append('  ... and {} more'.format(len(changes) - max_changes))
+        return '\n'.join(lines)
+
+
+def _format(value):
+    if isinstance(value, tuple):
+        return '/'.join(str(v) for v in value)
+    return str(value)
+
+def _compact(value):
+    """Return the value, or a digest of it if it is large"""
+    if isinstance(value, (str, bytes)) and len(value) <= _MAX_VALUE_SIZE:
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    encoded = json.dumps(value, sort_keys=True, default=repr)
+    if len(encoded) <= _MAX_VALUE_SIZE:
+        return value
+    return 'sha256:{}'.format(hashlib.sha256(encoded.encode()).hexdigest())
+
+def _equal(a, b):
+    # tuples and lists are equivalent, as exporting to JSON or YAML converts
+    # the former into the latter.
+    if a == b:
+        return True
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    return False
+
+
+def _compare_mappings(section, a, b, changes, value=lambda v: v):
+    """Compare two dictionaries key by key."""
+    a, b = a or {}, b or {}
+    for key in a.keys() - b.keys():
+        changes.append(Change(section, key, 'removed', value(a[key]), None))
+    for key in b.keys() - a.keys():
+        changes.append(Change(section, key, 'added', None, value(b[key])))
+    for key in a.keys() & b.keys():
+        if not _equal(a[key], b[key]):
+            changes.append(Change(section, key, 'changed',
+                                  value(a[key]), value(b[key])))
+
+def _packages(packages):
+    by_name = {}
+    for requirement in packages or []:
+        parsed = _parse_requirement(requirement)
+        if parsed is None:  # editable installs and comments
+            if not requirement.startswith('#'):
+                by_name[requirement] = requirement
+        else:
+            by_name[parsed[0].lower()] = parsed[1] or requirement
+    return by_name
+
+def _files(files, field):
+    return {(category, path): (info or {}).get(field)
+            for category, entries in (files or {}).items()
+            for path, info in (entries or {}).items()}
+
+def _repositories(repositories):
+    flat = {}
+    for path, info in (repositories or {}).items():
+        for field, value in (info or {}).items():
+            if field == 'diff' and isinstance(value, dict) and 'sha256' in value:
+                value = 'sha256:{}'.format(value['sha256'])
+            flat[(path, field)] = value
+    return flat
+
+
+def compare(a, b, ignore=DEFAULT_IGNORE):
+    """Compare two records of tracking data.
+
+    :param a:       the first record, as a dictionary.
+    :param b:       the second record, as a dictionary.
+    :param ignore:  top-level sections to ignore.
+    :return:        a `RecordDiff` of the changes from `a` to `b`.
+    """
+    changes = []
+    for section in sorted(set(a).union(b), key=str):
+        if section in ignore:
+            continue
+        old, new = a.get(section), b.get(section)
+        if _equal(old, new):
+            continue
+        section_changes = []
+        if section == 'packages':
+            _compare_mappings(section, _packages(old), _packages(new),
+                              section_changes)
+        elif section == 'files':
+            _compare_mappings(section, _files(old, 'sha256'),
+                              _files(new, 'sha256'), section_changes)
+        elif section == 'directories':
+            _compare_mappings(section, _files(old, 'merkle_root'),
+                              _files(new, 'merkle_root'), section_changes)
+        elif section == 'repositories':
+            _compare_mappings(section, _repositories(old), _repositories(new),
+                              section_changes, value=_compact)
+        elif section == 'cpuinfo':
+            old, new = old or {}, new or {}
+            old_flags, new_flags = set(old.get('flags', [])), set(new.get('flags', []))
+            for flag in sorted(old_flags - new_flags):
+                section_changes.append(Change(section, 'flags', 'removed', flag, None))
+            for flag in sorted(new_flags - old_flags):
+                section_changes.append(Change(section, 'flags', 'added', None, flag))
+            _compare_mappings(section,
+                              {k: v for k, v in old.items() if k != 'flags'},
+                              {k: v for k, v in new.items() if k != 'flags'},
+                              section_changes)
+        elif isinstance(old, dict) and isinstance(new, dict):
+            _compare_mappings(section, old, new, section_changes, value=_compact)
+        elif old is None:
+            section_changes.append(Change(section, None, 'added', None, _compact(new)))
+        elif new is None:
+            section_changes.append(Change(section, None, 'removed', _compact(old), None))
+        else:
+            section_changes.append(Change(section, None, 'changed',
+                                          _compact(old), _compact(new)))
+        section_changes.sort(key=lambda change: (change.kind, str(change.key)))
+        changes.extend(section_changes)
+    return RecordDiff(changes)
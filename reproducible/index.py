@@ -0,0 +1,254 @@
+"""Local index of exported tracking data, to query many records at once.
+
+The records exported by `export_json`, `export_yaml` or `export_msgpack` are
+ingested in a SQLite database, with normalized tables for the repositories,
+the files, the packages and the user data of each record.
+"""
+import os
+import json
+import hashlib
+import sqlite3
+
+from .reproducible import Context
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY, path TEXT, sha256 TEXT UNIQUE, timestamp TEXT,
+    platform TEXT, python TEXT);
+CREATE TABLE IF NOT EXISTS repositories (
+    record_id INTEGER REFERENCES records(id), path TEXT, hash TEXT,
+    dirty INTEGER, diff_sha256 TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    record_id INTEGER REFERENCES records(id), category TEXT, path TEXT,
+    sha256 TEXT, mtime REAL);
+CREATE TABLE IF NOT EXISTS directories (
+    record_id INTEGER REFERENCES records(id), category TEXT, path TEXT,
+    merkle_root TEXT);
+CREATE TABLE IF NOT EXISTS packages (
+    record_id INTEGER REFERENCES records(id), name TEXT, version TEXT,
+    requirement TEXT);
+CREATE TABLE IF NOT EXISTS data (
+    record_id INTEGER REFERENCES records(id), key TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS repositories_hash ON repositories (hash);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS directories_merkle_root ON directories (merkle_root);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE INDEX IF NOT EXISTS data_key ON data (key);
+"""
+
+# extensions of the files considered when ingesting a directory.
+RECORD_EXTENSIONS = ('.json', '.yaml', '.yml', '.msgpack', '.xz', '.zst')
+
+
+def _decode_errors():
+    """Return the exceptions raised by `Context.load` on malformed files."""
+    import lzma
+    errors = [ValueError, EOFError, lzma.LZMAError]  # JSON, encoding, xz
+    for module, name in (('yaml', 'YAMLError'),
+                         ('msgpack.exceptions', 'UnpackException'),
+                         ('zstandard', 'ZstdError')):
+        try:
+            errors.append(getattr(__import__(module, fromlist=[name]), name))
+        except (ImportError, AttributeError):
+            pass
+    return tuple(errors)
+
+
+def _parse_requirement(requirement):
+    """Return the (name, version) of a `pip freeze` line, or None."""
+    if requirement.startswith(('#', '-e')) or not requirement.strip():
+        return None
+    if '==' in requirement:
+        name, version = requirement.split('==', 1)
+        return name.strip(), version.strip()
+    if ' @ ' in requirement:
+        return requirement.split(' @ ', 1)[0].strip(), None
+    return requirement.strip(), None
+
+
+class Index:
+    """SQLite index of exported tracking data.
+
+    Records are ingested with `ingest`, and queried with `records_with_file`,
+    `records_with_commit`, `records_with_package` or, for arbitrary queries,
+    `query`.
+
+    :param path:  path of the SQLite database. Created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path    = path
+        self.skipped = []  # see `ingest`.
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ingest(self, paths):
+        """Ingest records in the index.
+
+        Records that were already ingested, identified by the SHA256 of their
+        file, are skipped, so ingesting a directory again only adds the new
+        records. Files that do not hold tracking data, such as unrelated JSON
+        files, are skipped too, and so are files that cannot be decoded, such
+        as malformed or partially written files: those are listed, with the
+        decoding error, in the `skipped` attribute.
+
+        :param paths:  paths of record files, or of directories, which are
+                       searched recursively for files with an extension in
+                       `RECORD_EXTENSIONS`.
+        :return:       the number of records added to the index.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        self.skipped = []
+        decode_errors = _decode_errors()
+        added = 0
+        for path in self._record_paths(paths):
+            sha256 = Context.sha256(path)
+            if self._conn.execute('SELECT 1 FROM records WHERE sha256=?',
+                                  (sha256,)).fetchone() is not None:
+                continue
+            try:
+                data = Context.load(path)
+            except decode_errors as exc:
+                self.skipped.append((path, exc))
+                continue
+            if not isinstance(data, dict) or 'python' not in data:
+                continue  # not tracking data.
+            with self._conn:  # one transaction per record.
+                self._add_record(path, sha256, data)
+            added += 1
+        return added
+
+    @classmethod
+    def _record_paths(cls, paths):
+        for path in paths:
+            if not os.path.isdir(path):
+                yield path
+                continue
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(RECORD_EXTENSIONS):
+                        yield os.path.join(dirpath, filename)
+
+    def _add_record(self, path, sha256, data):
+        python = data.get('python') or {}
+        version = python.get('version')
+        if isinstance(version, (list, tuple)):
+            version = '.'.join(str(v) for v in version)
+        timestamp = data.get('timestamp')
+        if isinstance(timestamp, (list, tuple)):
+            timestamp = timestamp[0] if timestamp else None
+        record_id = self._conn.execute(
+            'INSERT INTO records (path, sha256, timestamp, platform, python) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (os.path.abspath(path), sha256, timestamp, data.get('platform'),
+             '{} {}'.format(python.get('implementation'), version))).lastrowid
+
+        rows = []
+        for repo_path, info in (data.get('repositories') or {}).items():
+            diff = info.get('diff')
+            if isinstance(diff, dict):
+                diff_sha256 = diff.get('sha256')
+            elif diff is not None:
+                # inline diffs miss the trailing newline of the git output.
+                diff_sha256 = hashlib.sha256((diff + '\n').encode()).hexdigest()
+            else:
+                diff_sha256 = None
+            rows.append((record_id, repo_path, info.get('hash'),
+                         info.get('dirty'), diff_sha256))
+        self._conn.executemany('INSERT INTO repositories VALUES (?, ?, ?, ?, ?)',
+                               rows)
+
+        rows = [(record_id, category, file_path, info.get('sha256'),
+                 info.get('mtime'))
+                for category, files in (data.get('files') or {}).items()
+                for file_path, info in files.items()]
+        self._conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)', rows)
+
+        rows = [(record_id, category, dir_path, info.get('merkle_root'))
+                for category, dirs in (data.get('directories') or {}).items()
+                for dir_path, info in dirs.items()]
+        self._conn.executemany('INSERT INTO directories VALUES (?, ?, ?, ?)',
+                               rows)
+
+        rows = []
+        for requirement in data.get('packages') or []:
+            parsed = _parse_requirement(requirement)
+            if parsed is not None:
+                rows.append((record_id,) + parsed + (requirement,))
+        self._conn.executemany('INSERT INTO packages VALUES (?, ?, ?, ?)', rows)
+
+        rows = [(record_id, str(key), json.dumps(value, sort_keys=True,
+                                                  default=repr))
+                for key, value in (data.get('data') or {}).items()]
+        self._conn.executemany('INSERT INTO data VALUES (?, ?, ?)', rows)
+
+    def query(self, sql, params=()):
+        """Run an arbitrary SQL query on the index.
+
+        :return:  the rows, as a list of dictionaries.
+        """
+        cursor = self._conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _records(self, join, where, params):
+        return self.query('SELECT DISTINCT records.* FROM records {} WHERE {} '
+                          'ORDER BY records.timestamp'.format(join, where),
+                          params)
+
+    def records_with_file(self, sha256, category=None):
+        """Return the records that tracked a file with the given SHA256.
+
+        :param category:  if not None, only files of this category are
+                          considered.
+        """
+        where, params = 'files.sha256 = ?', (sha256,)
+        if category is not None:
+            where, params = where + ' AND files.category = ?', params + (category,)
+        return self._records('JOIN files ON files.record_id = records.id',
+                             where, params)
+
+    def records_with_commit(self, commit, dirty=None):
+        """Return the records that tracked a repository at the given commit.
+
+        :param commit:  the commit hash. Abbreviated hashes are accepted.
+        :param dirty:   if not None, only the records where the repository
+                        was, or was not, dirty are returned.
+        """
+        where, params = 'repositories.hash LIKE ?', (commit + '%',)
+        if dirty is not None:
+            where, params = where + ' AND repositories.dirty = ?', params + (int(dirty),)
+        return self._records('JOIN repositories ON '
+                             'repositories.record_id = records.id', where, params)
+
+    def records_with_package(self, name, version=None):
+        """Return the records where the given package was installed.
+
+        :param version:  if not None, only the records where this version of
+                         the package was installed are returned.
+        """
+        where, params = 'lower(packages.name) = lower(?)', (name,)
+        if version is not None:
+            where, params = where + ' AND packages.version = ?', params + (version,)
+        return self._records('JOIN packages ON packages.record_id = records.id',
+                             where, params)
+
+    def records_with_data(self, key, value):
+        """Return the records where the user data `key` had the given value."""
+        return self._records('JOIN data ON data.record_id = records.id',
+                             'data.key = ? AND data.value = ?',
+                             (str(key), json.dumps(value, sort_keys=True,
+                                                   default=repr)))
@@ -0,0 +1,104 @@
+"""Append-only journal of the changes made to the tracked data.
+
+Each change is appended to the journal file as one JSON object per line
+(JSON Lines). The changes are:
+
+- `{"op": "reset", "data": {...}}`: the tracked data is replaced.
+- `{"op": "set", "keys": [...], "value": ...}`: a value is set at the given
+  path of keys, creating the intermediate dictionaries if needed.
+- `{"op": "update", "keys": [...], "value": {...}}`: the dictionary at the
+  given path of keys is updated with the given dictionary.
+- `{"op": "del", "keys": [...]}`: the value at the given path is removed.
+
+Recording a change costs the same, however large the tracked data is. The
+final data is rebuilt by replaying the journal with `replay()`.
+"""
+import os
+import json
+import time
+
+
+class Journal:
+    """Append-only journal file, with batched fsync.
+
+    The journal is flushed and synced to disk every `sync_every` events, or
+    when the last sync is older than `sync_interval` seconds, whichever comes
+    first, so that at most one batch of events is lost on a crash.
+
+    :param path:           path of the journal file. If it exists, events are
+                           appended to it.
+    :param sync_every:     maximum number of events between two syncs.
+    :param sync_interval:  maximum time between two syncs, in seconds.
+    """
+
+    def __init__(self, path, sync_every=100, sync_interval=1.0):
+        self.path          = path
+        self.sync_every    = sync_every
+        self.sync_interval = sync_interval
+        self._file         = open(path, 'a', encoding='utf-8')
+        self._pending      = 0
+        self._last_sync    = time.monotonic()
+
+    def append(self, event):
+        """Append an event to the journal.
+
+        :raise TypeError:  if the event is not JSON serializable.
+        """
+        line = json.dumps(event, sort_keys=True, separators=(',', ':'))
+        self._file.write(line + '\n')
+        self._pending += 1
+        if (self._pending >= self.sync_every or
+            time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        """Flush the journal and sync it to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending   = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+def apply(data, event):
+    """Apply a journal event to `data`, and return the resulting data."""
+    op = event['op']
+    if op == 'reset':
+        return event['data']
+    keys, target = event['keys'], data
+    if op == 'del':
+        for key in keys[:-1]:
+            target = target.get(key, {})
+        target.pop(keys[-1], None)
+        return data
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    if op == 'set':
+        target[keys[-1]] = event['value']
+    elif op == 'update':
+        target.setdefault(keys[-1], {}).update(event['value'])
+    else:
+        raise ValueError("unknown journal operation '{}'".format(op))
+    return data
+
+
+def replay(path):
+    """Rebuild the tracked data from a journal file.
+
+    An incomplete last line, as left by a crash during a write, is ignored.
+    """
+    data = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):  # interrupted write
+                break
+            data = apply(data, json.loads(line))
+    return data
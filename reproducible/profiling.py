@@ -0,0 +1,146 @@
+"""Opt-in timing instrumentation of the collectors of `Context`.
+
+When profiling is enabled for a context, with `Context(profile=True)` or the
+`REPRODUCIBLE_PROFILE=1` environment variable, each call of an instrumented
+method (collection of the environment, git queries, hashing, exports) is
+measured: wall time, CPU time of the calling thread, bytes read and number of
+subprocesses run. Bytes and subprocesses are attributed to all the calls in
+progress, so that e.g. `add_file` includes the bytes read by `sha256`.
+
+The active calls are kept in a thread-local stack: class methods such as
+`sha256` or `git_snapshot` are profiled when they are called by a method of a
+profiled context, including from the worker threads of `_parallel_map`.
+"""
+import os
+import time
+import functools
+import threading
+
+
+ENV_VAR = 'REPRODUCIBLE_PROFILE'
+MEASURES = ('wall', 'cpu', 'bytes_read', 'subprocesses')
+
+_local = threading.local()
+
+
+def enabled_by_env():
+    """Return True if the `REPRODUCIBLE_PROFILE` environment variable enables
+    profiling."""
+    return os.environ.get(ENV_VAR, '').lower() not in ('', '0', 'false', 'no')
+
+
+class Profile:
+    """Totals of the measures of the instrumented calls of a context.
+
+    :param hooks:  functions called as `hook(name, measures)` after each
+                   instrumented call, where `measures` is a dictionary with
+                   the `wall`, `cpu`, `bytes_read` and `subprocesses` of the
+                   call.
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks   = list(hooks)
+        self.changed = False
+        self._totals = {}
+        self._lock   = threading.Lock()
+
+    def record(self, name, measures):
+        with self._lock:
+            total = self._totals.setdefault(name, dict.fromkeys(MEASURES, 0))
+            total['calls'] = total.get('calls', 0) + 1
+            for key in MEASURES:
+                total[key] += measures[key]
+            self.changed = True
+        for hook in list(self.hooks):
+            hook(name, measures)
+
+    def snapshot(self):
+        """Return the totals, for each instrumented function."""
+        with self._lock:
+            self.changed = False
+            return {name: dict(total) for name, total in self._totals.items()}
+
+    def __getstate__(self):
+        # hooks are often not picklable (e.g. bound to a metrics client).
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['hooks'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class _Call:
+    """An instrumented call in progress."""
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name    = name
+
+    def __enter__(self):
+        self.counts = {'bytes_read': 0, 'subprocesses': 0}
+        _stack().append(self)
+        self._wall, self._cpu = time.perf_counter(), time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        measures = dict(self.counts, wall=time.perf_counter() - self._wall,
+                        cpu=time.thread_time() - self._cpu)
+        _stack().pop()
+        self.profile.record(self.name, measures)
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def count(measure, n=1):
+    """Add `n` to a measure (`bytes_read` or `subprocesses`) of the calls in
+    progress, if any."""
+    for call in getattr(_local, 'stack', ()):
+        call.counts[measure] += n
+
+
+def instrumented(func):
+    """Decorator of the `Context` methods to profile.
+
+    The method is profiled if it is called on a context whose `_profile` is
+    not None, or, for class methods, from a profiled call.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self_or_cls, *args, **kwargs):
+        profile = self_or_cls.__dict__.get('_profile')
+        if profile is None:
+            stack = getattr(_local, 'stack', None)
+            if not stack:
+                return func(self_or_cls, *args, **kwargs)
+            profile = stack[-1].profile
+        with _Call(profile, name):
+            return func(self_or_cls, *args, **kwargs)
+    return wrapper
+
+
+def propagate(func):
+    """Return `func`, wrapped so that, when called from another thread, the
+    calls in progress in the current thread are also in progress there."""
+    calls = list(getattr(_local, 'stack', ()))
+    if not calls:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'stack', None)
+        _local.stack = list(calls)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.stack = previous if previous is not None else []
+    return wrapper
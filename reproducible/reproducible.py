@@ -3,26 +3,613 @@ import re
 import sys
 import copy
 import json
-import random
+import collections
+import time
+import fnmatch
 import hashlib
-import inspect
 import warnings
 import platform
+import threading
 import subprocess
 from datetime import datetime
 
-# GitPython
-import git
+from .cache import (HashCache, ResultCache, stat_key, cpu_info,
+                    read_cache_file, write_cache_file)
+from .journal import Journal, replay
+from .atomic import AtomicWriter
+from . import rng
+from . import arrays
+from . import profiling
 
-# py-cpuinfo, used for getting CPU specific capabilities
-from cpuinfo import get_cpu_info
+# GitPython, py-cpuinfo and PyYAML are imported only when needed, as they
+# noticeably increase the import time of reproducible.
 
-# is PyYAML installed?
-try:
-    import yaml
-    yaml_available = True
-except ImportError:
-    yaml_available = False
+# size of the buffers used to read files when hashing them.
+_BUFFER_SIZE = 1024 * 1024
+# one reusable read buffer per thread.
+_buffers = threading.local()
+
+
+def _import_yaml():
+    """Import and return the PyYAML module.
+
+    :raise ImportError:  if the `yaml` module cannot be imported.
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError('PyYAML does not seem present or importable.')
+    return yaml
+
+
+def _import_msgpack():
+    """Import and return the msgpack module.
+
+    :raise ImportError:  if the `msgpack` module cannot be imported.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError('msgpack does not seem present or importable.')
+    return msgpack
+
+
+def _msgpack_default(obj):
+    """Keep the distinction between tuples and lists in msgpack data"""
+    if isinstance(obj, tuple):
+        return {'__type__': 'tuple', 'value': list(obj)}
+    raise TypeError('cannot serialize {!r}'.format(obj))
+
+def _msgpack_object_hook(obj):
+    """Restore the tuples encoded by `_msgpack_default`"""
+    if obj.get('__type__') == 'tuple':
+        return tuple(obj['value'])
+    return obj
+
+# magic numbers of the compressed formats supported by `export_msgpack`.
+_XZ_MAGIC   = b'\xfd7zXZ\x00'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+# encoder of the canonical JSON form of the tracked data. See `Context.digest`.
+_canonical_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'),
+                                      ensure_ascii=False, allow_nan=False)
+# containers larger than this are encoded element by element.
+_CANONICAL_CHUNK = 64
+
+
+def _canonical_chunks(obj):
+    """Yield the canonical JSON encoding of `obj`, in chunks.
+
+    The concatenation of the chunks is `_canonical_encoder.encode(obj)`, but
+    large dictionaries and lists are encoded element by element, so that the
+    whole encoding is never held in memory.
+    """
+    encode = _canonical_encoder.encode
+    if isinstance(obj, dict) and len(obj) > _CANONICAL_CHUNK:
+        separator = '{'
+        for key, value in sorted(obj.items(), key=lambda item: item[0]):
+            if not isinstance(key, str):  # as `json` converts keys
+                key = json.dumps(key)
+            yield separator + encode(key) + ':'
+            yield from _canonical_chunks(value)
+            separator = ','
+        yield '}' if separator == ',' else '{}'
+    elif isinstance(obj, (list, tuple)) and len(obj) > _CANONICAL_CHUNK:
+        separator = '['
+        for value in obj:
+            yield separator
+            yield from _canonical_chunks(value)
+            separator = ','
+        yield ']'
+    else:
+        yield encode(obj)
+
+# types encoded identically by orjson and the `json` module.
+_JSON_SCALARS = frozenset((str, int, bool, type(None)))
+
+def _orjson_compatible(data):
+    """Return True if orjson encodes `data` exactly as `_dumps_json` does with
+    the `json` module.
+
+    orjson encodes NaN and infinite floats as null, writes exponents without
+    sign or leading zero (`1e16` rather than `1e+16`, `0.00001` rather than
+    `1e-05`), and supports types that the `json` module rejects, such as
+    `datetime`, `UUID` or dataclasses. Dictionaries with non-string keys are
+    sorted differently, and the `json` module rejects those mixing keys of
+    different types. Strings are encoded identically.
+    """
+    stack = [(data,)]
+    while stack:
+        obj = stack.pop()
+        if type(obj) is dict:
+            for key in obj:
+                if type(key) is not str:
+                    return False
+            values = obj.values()
+        else:
+            values = obj
+        for value in values:
+            cls = type(value)
+            if cls in _JSON_SCALARS:
+                continue
+            if cls is dict or cls is list or cls is tuple:
+                stack.append(value)
+            elif cls is float:
+                # `repr` uses an exponent outside of this range.
+                if not (1e-4 <= abs(value) < 1e16 or value == 0.0):
+                    return False
+            else:
+                return False
+    return True
+
+def _orjson_dumps(data):
+    """Return `data` as indented JSON, with sorted keys, encoded with orjson,
+    as bytes, or None if orjson is not installed or cannot encode `data` as
+    the `json` module would. See `_dumps_json`."""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    if not _orjson_compatible(data):
+        return None
+    try:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    except TypeError:  # e.g. integers larger than 64 bits.
+        return None
+
+def _dumps_json(data, fast=True):
+    """Return `data` as indented JSON, with sorted keys.
+
+    orjson is used if it is installed, as it is several times faster than the
+    `json` module. The `json` module is used otherwise, or if the data holds
+    values orjson encodes differently or that `json` rejects, such as NaN,
+    floats written with an exponent, `datetime` instances or integers larger
+    than 64 bits, so that the exported bytes do not depend on orjson being
+    installed. Non-ASCII characters are not escaped.
+
+    :param fast:  if False, the `json` module is always used.
+    """
+    content = _orjson_dumps(data) if fast else None
+    if content is not None:
+        return content.decode('utf-8')
+    return json.dumps(data, sort_keys=True, indent=2, ensure_ascii=False)
+
+def _dumps_yaml(data):
+    """Return `data` as YAML."""
+    return _import_yaml().safe_dump(data, indent=2, allow_unicode=True)
+
+def _dumps_msgpack(data):
+    """Return `data` encoded with msgpack, tuples included."""
+    return _import_msgpack().packb(data, use_bin_type=True, strict_types=True,
+                                   default=_msgpack_default)
+
+
+def _compress(content, compression):
+    """Compress bytes with 'xz', 'zstd' or None (no compression).
+
+    :raise ImportError:  if zstd is requested and the `zstandard` module cannot
+                         be imported.
+    """
+    if compression == 'xz':
+        import lzma
+        return lzma.compress(content)
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstandard does not seem present or importable.')
+        return zstandard.ZstdCompressor().compress(content)
+    elif compression is not None:
+        raise ValueError("unknown compression '{}'".format(compression))
+    return content
+
+def _write_bytes(path, content):
+    """Write `content` to `path` atomically, and return its SHA256
+    hexadecimal string."""
+    with AtomicWriter(path) as f:
+        f.write(content)
+    return f.sha256
+
+
+def _code_digest(code):
+    """Return the SHA256 of the bytecode, constants and names of a code
+    object, and of the code objects it contains (nested functions, ...).
+
+    Line numbers and file names are not included, so that moving a function
+    does not change its digest.
+    """
+    digest = hashlib.sha256(code.co_code)
+    for const in code.co_consts:
+        digest.update(_const_repr(const).encode())
+    digest.update(repr(code.co_names).encode())
+    return digest.hexdigest()
+
+def _const_repr(const):
+    """Return a representation of a constant of a code object that does not
+    depend on the process: the order of the items of frozensets, e.g. of
+    `x in {'a', 'b'}`, depends on the hash seed of strings."""
+    if hasattr(const, 'co_code'):
+        return _code_digest(const)
+    if isinstance(const, tuple):
+        return '({})'.format(','.join(_const_repr(c) for c in const))
+    if isinstance(const, frozenset):
+        return 'frozenset({{{}}})'.format(','.join(sorted(_const_repr(c)
+                                                          for c in const)))
+    return repr(const)
+
+def _canonical_value(obj):
+    """Return the arguments of a memoized function as JSON-serializable data,
+    that is different for values that are not equal, or of different types.
+
+    Tuples, sets, and dictionaries with non-string keys are tagged with their
+    type, as in `_msgpack_default`, so that e.g. `(1, 2)` and `[1, 2]`, or
+    `{1: x}` and `{'1': x}`, are not confused. See `_canonical_default` for
+    other objects.
+    """
+    cls = type(obj)
+    if cls in (str, int, float, bool, type(None)):
+        return obj
+    if cls is list:
+        return [_canonical_value(value) for value in obj]
+    if cls is tuple:
+        return {'__type__': 'tuple',
+                'value': [_canonical_value(value) for value in obj]}
+    if cls is dict:
+        if all(type(key) is str for key in obj) and '__type__' not in obj:
+            return {key: _canonical_value(value) for key, value in obj.items()}
+        items = [[_canonical_value(key), _canonical_value(value)]
+                 for key, value in obj.items()]
+        return {'__type__': 'dict',
+                'items': sorted(items, key=lambda item: json.dumps(
+                                                item[0], sort_keys=True))}
+    if cls in (set, frozenset):
+        values = [_canonical_value(value) for value in obj]
+        return {'__type__': cls.__name__,
+                'value': sorted(values, key=lambda value: json.dumps(
+                                                value, sort_keys=True))}
+    return _canonical_default(obj)
+
+def _canonical_default(obj):
+    """Canonical form of the arguments of memoized functions that are not
+    JSON data: arrays and other objects are replaced by a digest."""
+    if isinstance(obj, os.PathLike):
+        return {'__type__': 'path', 'value': os.fspath(obj)}
+    if hasattr(obj, 'tobytes') and hasattr(obj, 'dtype'):  # numpy array
+        return {'__type__': 'ndarray', 'dtype': str(obj.dtype),
+                'shape': list(getattr(obj, 'shape', ())),
+                'sha256': hashlib.sha256(obj.tobytes()).hexdigest()}
+    import pickle
+    return {'__type__': 'pickle', 'sha256': hashlib.sha256(
+                pickle.dumps(obj, protocol=4)).hexdigest()}
+
+
+def _parallel_map(func, items, workers=None):
+    """Return `[func(item) for item in items]`, computed by a pool of threads.
+
+    :param workers:  number of threads. If None, the default of
+                     `ThreadPoolExecutor` is used. If 1, no thread is created.
+    """
+    if workers == 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+    func = profiling.propagate(func)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+# packages omitted by `pip freeze`, and therefore by `_installed_packages`.
+_FREEZE_EXCLUDED = ('pip', 'setuptools', 'wheel', 'distribute')
+# in-process cache of `_installed_packages`, keyed by `_packages_key()`.
+_packages = {}
+
+
+def _package_dirs():
+    """Return the directories that are searched for installed packages.
+
+    Those are the `sys.path` entries, except the current directory, which
+    `pip freeze` would not consider either.
+    """
+    cwd = os.getcwd()
+    return [path for path in sys.path
+            if path and os.path.isdir(path) and os.path.abspath(path) != cwd]
+
+def _packages_key(dirs):
+    """Key identifying the state of the installed packages.
+
+    Installing, upgrading or removing a package creates or removes entries in
+    the package directories, changing their mtime.
+    """
+    return [[path, os.stat(path).st_mtime_ns] for path in dirs]
+
+def _distributions(dirs):
+    """Return the installed distributions, by normalized name.
+
+    If a distribution is installed in several directories, the one found first,
+    which is the one imported, is returned.
+    """
+    from importlib import metadata
+    dists = {}
+    for dist in metadata.distributions(path=dirs):
+        name = dist.metadata['Name']
+        if name is None:  # broken installation
+            continue
+        name = re.sub(r'[-_.]+', '-', name).lower()  # PEP 503 normalization
+        dists.setdefault(name, dist)
+    return dists
+
+def _editable_installs():
+    """Return the `(name, version, path)` of the packages installed in
+    editable mode from a local directory, from their `direct_url.json`
+    metadata (PEP 610)."""
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+    editables = []
+    for _, dist in sorted(_distributions(_package_dirs()).items()):
+        direct_url = _direct_url(dist)
+        if direct_url is None:
+            continue
+        url = urlparse(direct_url['url'])
+        if (url.scheme == 'file' and 'vcs_info' not in direct_url
+            and direct_url.get('dir_info', {}).get('editable', False)):
+            editables.append((dist.metadata['Name'], dist.version,
+                              url2pathname(url.path)))
+    return editables
+
+def _direct_url(dist):
+    """Return the `direct_url.json` metadata of a distribution (PEP 610), or
+    None if there is none, or if it is invalid, which pip ignores too."""
+    direct_url = dist.read_text('direct_url.json')
+    if not direct_url:
+        return None
+    try:
+        direct_url = json.loads(direct_url)
+    except ValueError:
+        return None
+    if not (isinstance(direct_url, dict) and isinstance(direct_url.get('url'), str)
+            and isinstance(direct_url.get('dir_info', {}), dict)):
+        return None
+    vcs_info = direct_url.get('vcs_info', {'vcs': None, 'commit_id': None})
+    if not (isinstance(vcs_info, dict) and 'vcs' in vcs_info
+            and 'commit_id' in vcs_info):
+        return None
+    return direct_url
+
+def _requirement(dist):
+    """Return the lines describing a distribution, in `pip freeze` format."""
+    name, version = dist.metadata['Name'], dist.version
+    direct_url = _direct_url(dist)
+    if direct_url is None:
+        return ['{}=={}'.format(name, version)]
+    url = direct_url['url']
+    editable = direct_url.get('dir_info', {}).get('editable', False)
+    if 'vcs_info' in direct_url:
+        vcs_info = direct_url['vcs_info']
+        url = '{}+{}@{}'.format(vcs_info['vcs'], url, vcs_info['commit_id'])
+        if editable:
+            return ['-e {}#egg={}'.format(url, name)]
+    elif editable:
+        from urllib.parse import urlparse, unquote
+        return ['# Editable install ({}=={})'.format(name, version),
+                '-e {}'.format(unquote(urlparse(url).path))]
+    return ['{} @ {}'.format(name, url)]
+
+def _installed_packages(cache=True):
+    """Return the list of installed packages, in `pip freeze` format.
+
+    The packages are gathered in-process, from the distributions metadata. The
+    result is cached in memory and on disk, and is reused as long as the
+    packages directories were not modified.
+
+    :param cache:  if False, the caches are neither read nor updated.
+    """
+    if sys.version_info < (3, 8):  # no `importlib.metadata`
+        profiling.count('subprocesses')
+        output = subprocess.check_output([sys.executable, '-m', 'pip',
+                                          'freeze', '-qq'])
+        return output.decode().split('\n')[:-1]
+
+    dirs = _package_dirs()
+    key = _packages_key(dirs)
+    filename = 'packages-{}.json'.format(
+                     hashlib.sha256(sys.prefix.encode()).hexdigest()[:32])
+    if cache:
+        packages = _packages.get(json.dumps(key))
+        if packages is None:
+            packages = read_cache_file(filename, key)
+        if packages is not None:
+            _packages[json.dumps(key)] = packages
+            return list(packages)
+
+    dists = _distributions(dirs)
+    packages = []
+    for name, dist in sorted(dists.items()):
+        if name not in _FREEZE_EXCLUDED:
+            packages.extend(_requirement(dist))
+
+    if cache:
+        _packages[json.dumps(key)] = packages
+        write_cache_file(filename, key, packages)
+    return list(packages)
+
+
+# `git.Repo` instances and git versions, cached by path.
+_repos = {}
+_git_versions = {}
+
+
+def _in_background(func, *args, **kwargs):
+    """Call `func(*args, **kwargs)` in a daemon thread.
+
+    :return:  a `concurrent.futures.Future` of the result.
+    """
+    from concurrent.futures import Future
+    future = Future()
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _parse_git_status(status):
+    """Parse the output of `git status --porcelain=v2 --branch`.
+
+    :return:  `(head, dirty, untracked)`. `head` is None if there is no commit.
+    """
+    head, dirty, untracked = None, False, False
+    for line in status.splitlines():
+        if line.startswith('# branch.oid '):
+            head = line[len('# branch.oid '):]
+            if head == '(initial)':  # no commit yet
+                head = None
+        elif line[:2] in ('1 ', '2 ', 'u '):
+            dirty = True
+        elif line.startswith('? '):
+            untracked = True
+    return head, dirty, untracked
+
+def _parse_git_numstat(numstat):
+    """Parse the output of `git diff --numstat`."""
+    changes = []
+    for line in numstat.splitlines():
+        added, deleted, filepath = line.split('\t', 2)
+        changes.append({'path': filepath,
+                        'added': None if added == '-' else int(added),
+                        'deleted': None if deleted == '-' else int(deleted)})
+    return changes
+
+
+class _DiffWriter:
+    """Receive a diff streamed from git, and hash it, keep it in memory or
+    write it, gzip-compressed, in `store`. See `Context.git_snapshot`.
+
+    `write` returns False once the diff is larger than `max_size`; the diff
+    must then be discarded with `abort`. Else, `finish` returns the diff, or
+    the dictionary describing the stored diff.
+    """
+
+    def __init__(self, store=None, max_size=None):
+        self.store, self.max_size = store, max_size
+        self.size, self.truncated = 0, False
+        self._sha256, self._chunks = hashlib.sha256(), []
+        self._file, self._out = None, None
+        if store is not None:
+            import gzip
+            os.makedirs(os.path.join(store, 'diffs'), exist_ok=True)
+            # the final name, the digest of the diff, is known in `finish`.
+            self._file = AtomicWriter(os.path.join(store, 'diffs', 'diff'),
+                                      hashed=False)
+            self._out = gzip.GzipFile(fileobj=self._file, mode='wb', mtime=0)
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            self.truncated = True
+            return False
+        self._sha256.update(chunk)
+        if self._out is not None:
+            self._out.write(chunk)
+        else:
+            self._chunks.append(chunk)
+        return True
+
+    def abort(self):
+        if self._file is not None and not self._file.closed:
+            self._out.close()
+            self._file.abort()
+
+    def finish(self):
+        if self.store is None:
+            # git output minus the trailing newline, as `repo.git.diff()`.
+            patch = b''.join(self._chunks).decode('utf-8', 'replace')
+            return patch[:-1] if patch.endswith('\n') else patch
+        digest = self._sha256.hexdigest()
+        path = os.path.join(self.store, 'diffs', '{}.patch.gz'.format(digest))
+        try:
+            self._out.close()
+        except BaseException:
+            self._file.abort()
+            raise
+        self._file.close(path)
+        return {'sha256': digest, 'size': self.size, 'path': path}
+
+
+async def _agit(cwd, *args):
+    """Run a git command with an asyncio subprocess, and return its output.
+
+    :raise RepositoryNotFound:  if `cwd` is not in a git repository.
+    :raise subprocess.CalledProcessError:  if git fails otherwise.
+    """
+    import asyncio
+    proc = await asyncio.create_subprocess_exec(
+                'git', *args, cwd=cwd, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        if b'not a git repository' in stderr:
+            raise RepositoryNotFound("git repository not found "
+                                     "at '{}'".format(cwd))
+        raise subprocess.CalledProcessError(proc.returncode, ('git',) + args,
+                                            stdout, stderr)
+    return stdout.decode('utf-8', 'replace')
+
+
+class _CallRecorder:
+    """Bounded buffer of the calls recorded by `Context.record_calls`."""
+
+    def __init__(self, name, maxlen=1000, every=1, max_rate=None):
+        self.name     = name
+        self.every    = every
+        self.max_rate = max_rate
+        self._entries = collections.deque(maxlen=maxlen)
+        self._lock    = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.calls, self.recorded, self.dirty = 0, 0, False
+            self._allowance, self._last = self._burst(), time.monotonic()
+
+    def _burst(self):
+        """Capacity of the token bucket: at least one call, so that rates
+        below one call per second record calls too."""
+        return None if self.max_rate is None else max(1, self.max_rate)
+
+    def sample(self):
+        """Count a call, and return True if it should be recorded."""
+        with self._lock:
+            self.calls += 1
+            self.dirty = True
+            if self.every > 1 and (self.calls - 1) % self.every:
+                return False
+            if self.max_rate is not None:  # token bucket
+                now = time.monotonic()
+                self._allowance = min(self._burst(), self._allowance +
+                                      (now - self._last) * self.max_rate)
+                self._last = now
+                if self._allowance < 1:
+                    return False
+                self._allowance -= 1
+            return True
+
+    def append(self, arguments):
+        with self._lock:
+            self.recorded += 1
+            self._entries.append({'call': self.calls, 'time': time.time(),
+                                  'args': arguments})
+            self.dirty = True
+
+    def snapshot(self):
+        """Return the recorded calls, as added to the tracked data."""
+        with self._lock:
+            self.dirty = False
+            return {'calls': self.calls, 'recorded': self.recorded,
+                    'entries': list(self._entries)}
 
 
 class RepositoryNotFound(Exception):
@@ -35,6 +622,73 @@ class RepositoryDirty(Exception):
     or untracked changes."""
     pass
 
+class MergeConflict(Exception):
+    """Raised by `Context.merge` when contexts recorded different values for
+    the same entry.
+
+    :ivar conflicts:  list of `(keys, value, other_value)` tuples, where `keys`
+                      is the path of the entry in the tracked data.
+    """
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        lines = ['{} conflicting entries'.format(len(conflicts))]
+        for keys, _, _ in conflicts[:10]:
+            lines.append('  {}'.format('/'.join(str(key) for key in keys)))
+        if len(conflicts) > 10:
+            lines.append('  ...')
+        super().__init__('\n'.join(lines))
+
+
+_missing = object()
+
+# sections of the tracked data merged by `Context.merge`, with the depth of
+# their entries: e.g. files are identified by their category and path.
+_MERGED_SECTIONS = {'files': 2, 'directories': 2, 'repositories': 1, 'data': 1}
+
+
+class VerificationReport:
+    """Result of `Context.verify`.
+
+    The files are identified by `(category, path)` tuples.
+
+    :ivar unchanged:   the files matching their record.
+    :ivar modified:    the files whose content changed.
+    :ivar missing:     the files that do not exist anymore.
+    :ivar bytes_read:  number of bytes read to hash the files.
+    :ivar elapsed:     duration of the verification, in seconds.
+    """
+
+    def __init__(self, unchanged, modified, missing, bytes_read, elapsed):
+        self.unchanged  = unchanged
+        self.modified   = modified
+        self.missing    = missing
+        self.bytes_read = bytes_read
+        self.elapsed    = elapsed
+
+    @property
+    def ok(self):
+        """True if all files are present and unchanged."""
+        return not self.modified and not self.missing
+
+    @property
+    def throughput(self):
+        """Hashing throughput, in bytes per second."""
+        return self.bytes_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        """Return a human-readable summary of the verification."""
+        lines = ['{} unchanged, {} modified, {} missing ({} files)'.format(
+                     len(self.unchanged), len(self.modified), len(self.missing),
+                     len(self.unchanged) + len(self.modified) + len(self.missing))]
+        for label, files in (('modified', self.modified),
+                             ('missing', self.missing)):
+            for category, path in files:
+                lines.append('  {}: [{}] {}'.format(label, category, path))
+        lines.append('{:.1f} MB read in {:.2f} s ({:.1f} MB/s)'.format(
+                         self.bytes_read / 1e6, self.elapsed,
+                         self.throughput / 1e6))
+        return '\n'.join(lines)
+
 
 class Context:
     """The `Context` class gathers the provenance data, some automatically
@@ -49,21 +703,179 @@ class Context:
                      be important, as optimized numerical libraries will use
                      the CPU instruction sets as they are available, and
                      therefore may behave differently on different processors.
-                     Note that this is a costly call (1-2 seconds).
+                     Note that this is a costly call (1-2 seconds), whose
+                     result is cached on disk until the next reboot (see
+                     `add_cpu_info`).
+    :param hash_cache:  if not None, a persistent cache of file digests is used
+                        by `add_file`, so that files that were not modified
+                        since they were last hashed are not read again. Can be
+                        True (for the default cache, in `~/.cache/reproducible`),
+                        the path to a cache database, or a `HashCache` instance.
+                        Disabled by default.
+    :param store:       directory where large data is stored out-of-line, in
+                        content-addressed sidecar files, rather than embedded
+                        in the tracked data. Currently, this concerns the diffs
+                        of repositories (see `git_snapshot`) and the arrays
+                        given to `add_data`. If None, the data is kept inline.
+    :param array_threshold:  arrays given to `add_data` larger than this, in
+                        bytes, are written in the `store`.
+    :param max_diff_size:  maximum size, in bytes, of the diff of a repository.
+                        Above it, only a per-file summary of the changes is
+                        recorded. If None, diffs are not limited in size.
+    :param journal:     path to a journal file. If not None, `open_journal` is
+                        called with it.
+    :param background:  if True, the CPU info and the installed packages are
+                        collected in background threads, and so are the
+                        repositories added with `add_repo(allow_dirty=True)`.
+                        The computation can then start immediately. Their
+                        results are added to the tracked data the next time
+                        `data` is accessed, which waits for the collection to
+                        finish if needed, as do the export functions.
+    :param async_workers:  maximum number of threads used by the asynchronous
+                        functions (`aadd_file`, `aexport_json`, ...) to hash and
+                        write files, and maximum number of git subprocesses
+                        they run concurrently. If None, `min(32, cpus + 4)`.
+    :param profile:     if True, the wall and CPU time, the bytes read and the
+                        number of subprocesses of the collectors (`git_info`,
+                        `sha256`, the exporters, ...) are measured, and their
+                        totals added to the `_profile` section of the tracked
+                        data. If None, profiling is enabled if the
+                        `REPRODUCIBLE_PROFILE` environment variable is set to
+                        1. See `add_profile_hook`.
     """
 
-    def __init__(self, cpuinfo=False, pip_packages=False):
+    def __init__(self, cpuinfo=False, pip_packages=False, hash_cache=None,
+                 store=None, max_diff_size=None, journal=None,
+                 background=False, async_workers=None, array_threshold=4096,
+                 profile=None):
         self.collect_cpuinfo      = cpuinfo
         self.collect_pip_packages = pip_packages
+        self.background           = background
+        self.async_workers        = async_workers
+        self._executor            = None  # created on first use.
+        self._semaphore           = None  # (event loop, asyncio.Semaphore)
+        self.fork_name            = None  # set by `fork()`.
+        self._fork_count          = 0
+        self._recorders           = []    # see `record_calls()`.
+        self.store                = store
+        self.max_diff_size        = max_diff_size
+        self.array_threshold      = array_threshold
+        if profile is None:
+            profile = profiling.enabled_by_env()
+        self._profile = profiling.Profile() if profile else None
+        if hash_cache is True:
+            hash_cache = HashCache()
+        elif hash_cache is False:
+            hash_cache = None
+        elif isinstance(hash_cache, str):
+            hash_cache = HashCache(hash_cache)
+        self.hash_cache = hash_cache
+        self._journal   = None
         self.reset()
+        if journal is not None:
+            self.open_journal(journal)
+
+    def __getstate__(self):
+        # the journal and the thread pool cannot be pickled, e.g. to send the
+        # context to a `multiprocessing` worker; data being collected in the
+        # background is waited for, and recorded calls are flushed.
+        self.data
+        state = self.__dict__.copy()
+        state.update(_pending=[], _journal=None, _executor=None,
+                     _semaphore=None, _recorders=[])
+        return state
 
     def reset(self):
         """Reset the context data"""
-        self.data = self._collect_basic_data(cpuinfo=self.collect_cpuinfo,
-                                             pip_packages=self.collect_pip_packages)
+        self._pending = []  # results of background collectors are discarded.
+        for recorder in self._recorders:
+            recorder.clear()
+        self.data = self._collect_basic_data(
+                cpuinfo=self.collect_cpuinfo and not self.background,
+                pip_packages=self.collect_pip_packages and not self.background)
+        self._log({'op': 'reset', 'data': self._data})
+        if self.background:
+            if self.collect_cpuinfo:
+                self._defer(('cpuinfo',), self._cpu_info)
+            if self.collect_pip_packages:
+                self._defer(('packages',), self._pip_freeze)
+
+    @property
+    def data(self):
+        """The tracked data, as a dictionary.
+
+        If some data is being collected in the background, accessing `data`
+        waits for it to be available. The calls recorded by `record_calls` are
+        added to it.
+        """
+        if self._pending:
+            self._finalize()
+        for recorder in self._recorders:
+            if recorder.dirty:
+                self._set(('calls', recorder.name), recorder.snapshot())
+        if self._profile is not None and self._profile.changed:
+            self._set(('_profile',), self._profile.snapshot())
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def _defer(self, keys, func, *args, **kwargs):
+        """Compute `func(*args, **kwargs)` in a background thread.
+
+        The result is set in the tracked data, at the path `keys`, when `data`
+        is next accessed. See `_set`.
+        """
+        func = profiling.propagate(func)
+        self._pending.append((keys, _in_background(func, *args, **kwargs)))
+
+    def _finalize(self):
+        """Wait for the background collectors, and add their results to the
+        tracked data.
+
+        :raise Exception:  the first exception raised by a collector, if any,
+                           once the results of the other ones have been added.
+        """
+        pending, self._pending = self._pending, []
+        error = None
+        for keys, future in pending:
+            try:
+                self._set(keys, future.result())
+            except Exception as exc:
+                error = error or exc
+        if error is not None:
+            raise error
+
+    def _set(self, keys, value):
+        """Set a value in the tracked data, and record it in the journal.
+
+        The intermediate dictionaries are created if they do not exist.
+
+        :param keys:  path of keys to the value, e.g. `('files', category, path)`.
+        """
+        target = self._data
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+        self._log({'op': 'set', 'keys': keys, 'value': value})
+
+    def _update(self, keys, values):
+        """Update a dictionary of the tracked data, and record it in the
+        journal. See `_set`."""
+        target = self._data
+        for key in keys:
+            target = target.setdefault(key, {})
+        target.update(values)
+        self._log({'op': 'update', 'keys': keys, 'value': values})
+
+    def _log(self, event):
+        if self._journal is not None and not self._journal.closed:
+            self._journal.append(event)
 
     ## Basic Stuff
 
+    @profiling.instrumented
     def _collect_basic_data(self, cpuinfo=True, pip_packages=True):
         data = {'python' : {'implementation': platform.python_implementation(),
                                   'version' : platform.python_version_tuple(),
@@ -77,7 +889,7 @@ class Context:
                 'timestamp'   : self._timestamp(),
                }
         if cpuinfo:
-            data['cpuinfo'] = get_cpu_info()
+            data['cpuinfo'] = self._cpu_info()
         if pip_packages:
             data['packages'] = self._pip_freeze()
         return data
@@ -102,32 +914,199 @@ class Context:
         context data. Use `add_data()` with the return of this function to do
         that.
         """
-        frame = inspect.stack(context=1)[1][0]
-        return inspect.getargvalues(frame).locals
+        # `inspect.stack()` would read the source of every frame of the stack.
+        return dict(sys._getframe(1).f_locals)
+
+    def record_calls(self, func=None, maxlen=1000, every=1, max_rate=None):
+        """Decorator recording the arguments of the calls to a function.
+
+        Recording is cheap enough for functions called millions of times: the
+        arguments are bound to their names without inspecting the stack, and
+        the calls are kept in a bounded buffer, that holds only the `maxlen`
+        most recent recorded calls. The number of recorded calls can be
+        further reduced by recording only one call out of `every`, and at
+        most `max_rate` calls per second.
+
+        The recorded calls are added to the tracked data, under
+        `data['calls'][<module>.<function name>]`, when `data` is accessed,
+        e.g. when exporting: a dictionary with the total number of `calls`,
+        the number of calls `recorded`, and the recorded `entries`, each with
+        the number of the `call`, its `time` and its `args`. Arguments are
+        not copied, and must be serializable in the export format.
+
+        Can be used as `@record_calls` or `@record_calls(maxlen=...)`.
+
+        :param maxlen:    maximum number of recorded calls kept.
+        :param every:     record one call out of `every`, starting with the
+                          first one.
+        :param max_rate:  maximum number of calls recorded per second, on
+                          average. If None, no limit.
+        """
+        if func is None:
+            return lambda func: self.record_calls(func, maxlen=maxlen,
+                                                  every=every, max_rate=max_rate)
+        import inspect
+        import functools
+        recorder = _CallRecorder('{}.{}'.format(func.__module__, func.__qualname__),
+                                 maxlen=maxlen, every=every, max_rate=max_rate)
+        self._recorders.append(recorder)
+
+        signature = inspect.signature(func)
+        simple = all(p.kind == p.POSITIONAL_OR_KEYWORD
+                     for p in signature.parameters.values())
+        names = list(signature.parameters)
+        defaults = {name: p.default for name, p in signature.parameters.items()
+                    if p.default is not p.empty}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if recorder.sample():
+                if simple and len(args) <= len(names):
+                    arguments = dict(defaults)
+                    arguments.update(zip(names, args))
+                    arguments.update(kwargs)
+                else:
+                    bound = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    arguments = dict(bound.arguments)
+                recorder.append(arguments)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+
+    ## Memoization
+
+    def memoize(self, func=None, cache=None):
+        """Decorator caching the results of a function on disk.
+
+        The result of a call is reused when the function is called again with
+        the same arguments, the same code, the same state of the repositories
+        added with `add_repo`, and the same content of the input files, i.e.
+        of the arguments that are paths to existing files. The cache key is a
+        SHA256 of all of those: arguments are encoded as canonical JSON, and
+        those that are not JSON-serializable by their pickle or, for numpy
+        arrays, their content. Note that global variables and the functions
+        called by the function are not part of the key.
+
+        The numbers of cache hits and misses of each function are recorded in
+        the tracked data, under `data['memoize']`.
+
+        Can be used as `@memoize` or `@memoize(cache=...)`.
+
+        :param cache:  a `ResultCache` instance, or the path of its directory.
+                       If None, the default `ResultCache` is used, in
+                       `~/.cache/reproducible/results`, limited to 1 GB.
+        :raise TypeError:  if an argument cannot be encoded, or if a result
+                           cannot be pickled.
+        """
+        if func is None:
+            return lambda func: self.memoize(func, cache=cache)
+        import inspect
+        import functools
+        if not isinstance(cache, ResultCache):
+            cache = ResultCache(cache)
+        signature = inspect.signature(func)
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+        code = _code_digest(func.__code__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = self._memoize_key(name, code, bound.arguments)
+            result = cache.get(key, _missing)
+            stats = self._data.get('memoize', {}).get(name, {})
+            if result is not _missing:
+                self._update(('memoize', name), {'hits': stats.get('hits', 0) + 1})
+                return result
+            result = func(*args, **kwargs)
+            cache.set(key, result)
+            self._update(('memoize', name), {'misses': stats.get('misses', 0) + 1})
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+
+    def _memoize_key(self, name, code, arguments):
+        """Return the cache key of a call of a memoized function."""
+        args = json.dumps(_canonical_value(dict(arguments)), sort_keys=True)
+
+        files = {}
+        for arg_name, value in arguments.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for i, path in enumerate(values):
+                if (isinstance(path, (str, os.PathLike))
+                    and os.path.isfile(path)):
+                    files['{}[{}]'.format(arg_name, i)] = self.sha256(
+                                                path, cache=self.hash_cache)
+
+        repositories = {path: [info.get('hash'), info.get('dirty'),
+                               json.dumps(info.get('diff'), sort_keys=True)]
+                        for path, info in self._data.get('repositories', {}).items()}
+
+        content = json.dumps({'function': name, 'code': code, 'args': args,
+                              'files': files, 'repositories': repositories},
+                             sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
 
 
     ## Get Random State
 
-    def add_random_state(self):
+    def add_random_state(self, generators=None):
         """Record the current random state.
 
         The random state is different from the seed used in a `random.seed()`
         call. However, it can be used in the same way to produce reproducible
-        random sequences, using the `random.setstate()` method.
+        random sequences: `restore_random_state` restores it.
 
-        `record_random_state` should be called just after setting the seed, and
+        `add_random_state` should be called just after setting the seed, and
         before any use of the random draw functions. Note that you can also
         use the current time to set the seed using `random.seed()` without an
         argument, and still record the random state right after.
 
-        Only the random state from the `random` module is recorded here, along
-        with a timestamp of the recording time. If you wish to record the
-        random state of external libraries such as `numpy`, you should use the
-        `record_data()` method, and provide either the seed used or the
-        result of the `numpy.random.get_state()`.
+        The state of the `random` module is recorded, along with a timestamp
+        of the recording time. If numpy or torch have been imported, the state
+        of the global numpy generator (`numpy.random.seed()`) and of the torch
+        CPU generator (`torch.manual_seed()`) are recorded too. The states are
+        recorded in a compact form, as base64 strings.
+
+        :param generators:  other generators to record, as a dictionary of
+                            names to `random.Random`, numpy `Generator`,
+                            `BitGenerator` or `RandomState`, or torch
+                            `Generator` instances.
+        :raise TypeError:   if the type of a generator is not supported.
         """
-        self.data['random'] = {'state': random.getstate(),
-                                'timestamp': self._timestamp()}
+        states = rng.global_states()
+        if generators:
+            states['generators'] = {name: rng.generator_state(generator)
+                                    for name, generator in generators.items()}
+        states['timestamp'] = self._timestamp()
+        self._set(('random',), states)
+
+    def restore_random_state(self, record=None, generators=None):
+        """Restore the random state recorded by `add_random_state`.
+
+        :param record:      the record to restore the state from: a `Context`
+                            instance, a dictionary of tracked data, or the path
+                            to an exported record. If None, this context.
+        :param generators:  generators to restore, as a dictionary of names to
+                            generators, as given to `add_random_state`.
+        :raise KeyError:     if no random state, or no state for one of the
+                             `generators`, was recorded.
+        :raise ImportError:  if numpy or torch states were recorded, and numpy
+                             or torch cannot be imported.
+        """
+        if record is None:
+            record = self.data
+        elif isinstance(record, Context):
+            record = record.data
+        elif not isinstance(record, dict):
+            record = self.load(record)
+        states = record['random']
+        rng.restore_global_states(states)
+        for name, generator in (generators or {}).items():
+            rng.restore_generator_state(generator, states['generators'][name])
 
 
     ## User Data
@@ -138,16 +1117,51 @@ class Context:
         If you intend to export as json or yaml, the provided key and data must
         be serializable in those formats.
 
+        If the context has a `store`, numpy arrays, and objects supporting the
+        buffer protocol (`bytes`, `array.array`, ...), larger than the
+        `array_threshold` of the context, are written in the store as `.npy`
+        files, named by their SHA256, including when they are found in
+        dictionaries, lists or tuples. In the tracked data, they are replaced by
+        a dictionary with their `sha256`, `dtype`, `shape`, `size` (in bytes)
+        and `path`, from which `load_array` loads them back.
+
         :param key:   label for the data. It is recommended to use a string.
         :param data:  user-provided data.
+        :return:      `data`.
         """
-        self.data.setdefault('data', {})
-        self.data['data'][key] = data
+        if self.store is not None:
+            self._set(('data', key), arrays.store_arrays(
+                          self.store, data, threshold=self.array_threshold))
+        else:
+            self._set(('data', key), data)
         return data
 
+    @classmethod
+    def load_array(cls, entry, mmap=True, check=False):
+        """Load an array stored out-of-line by `add_data`.
+
+        :param entry:  the dictionary that replaced the array in the tracked
+                       data.
+        :param mmap:   if True, the file is memory-mapped, read-only, rather
+                       than read: no data is copied until it is accessed.
+        :param check:  if True, the SHA256 of the file is checked first.
+        :return:       the array, as a numpy array.
+        :raise ValueError:   if `entry` does not describe an array, or if
+                             `check` is True and the file was modified.
+        :raise ImportError:  if numpy cannot be imported.
+        """
+        if not arrays.is_array_entry(entry):
+            raise ValueError('not a stored array: {!r}'.format(entry))
+        if check and cls.sha256(entry['path']) != entry['sha256']:
+            raise ValueError("the array file '{}' was modified".format(
+                                                                entry['path']))
+        import numpy
+        return numpy.load(entry['path'], mmap_mode='r' if mmap else None)
+
 
     ## Version Control Repositories and Git methods
 
+    @profiling.instrumented
     def add_repo(self, path='.', allow_dirty=False, allow_untracked=False,
                        diff=True):
         """Add a version control repository to the tracking data. Only git is
@@ -164,19 +1178,29 @@ class Context:
         :param diff:         if True and uncommited changes are present in the
                              repository, the diff will be recorded in a
                              patchable form. Patch diffs of binary file can
-                             grow to large sizes.
+                             grow to large sizes: the `store` and
+                             `max_diff_size` parameters of the context allow to
+                             store it out-of-line, and to limit its size.
 
         :raise FileNotFoundError:  if the path does not exist.
         :raise RepositoryNotFound: if no repository was found.
         """
-        if (not allow_dirty) and self.git_dirty(path, allow_untracked=allow_untracked):
+        if self.background and allow_dirty:
+            self._defer(('repositories', path), self.git_info, path, diff=diff,
+                        store=self.store, max_diff_size=self.max_diff_size)
+            return
+        snapshot = self.git_snapshot(path, diff=diff and allow_dirty,
+                                     store=self.store,
+                                     max_diff_size=self.max_diff_size)
+        if (not allow_dirty) and (snapshot['dirty'] or
+                                  (snapshot['untracked'] and not allow_untracked)):
             raise RepositoryDirty("Repository '{}' is in a dirty state".format(path))
-        self.data.setdefault('repositories', {})
-        self.data['repositories'][path] = self.git_info(path, diff=diff)
+        self._set(('repositories', path), self._git_record(snapshot))
 
 
     @classmethod
-    def git_info(cls, path, diff=True):
+    @profiling.instrumented
+    def git_info(cls, path, diff=True, store=None, max_diff_size=None):
         """
         Retrieve data from the git repository.
 
@@ -187,21 +1211,107 @@ class Context:
         :param diff:         if True and uncommited changes are present in the
                              repository, the diff will be recorded in a
                              patchable form.
+        :param store:          see `git_snapshot`.
+        :param max_diff_size:  see `git_snapshot`.
+        :raise FileNotFoundError:  if the path does not exist.
+        :raise RepositoryNotFound: if no repository was found.
+        """
+        return cls._git_record(cls.git_snapshot(path, diff=diff, store=store,
+                                                max_diff_size=max_diff_size))
+
+    @classmethod
+    def _git_record(cls, snapshot):
+        """Return the part of a snapshot that is recorded in the tracked data"""
+        return {key: snapshot[key] for key in ('hash', 'dirty', 'version', 'diff')}
+
+    @classmethod
+    @profiling.instrumented
+    def git_snapshot(cls, path, diff=True, store=None, max_diff_size=None):
+        """
+        Retrieve the state of a git repository in a single pass.
+
+        The commit, the presence of uncommitted changes and of untracked files
+        are all obtained from a single `git status` call, and `git diff` is only
+        called if there are uncommitted changes. The `git.Repo` instance and the
+        git version are cached for each path, so subsequent calls are cheaper.
+
+        The diff is streamed from git. If `store` is provided, it is written,
+        gzip-compressed, in the `diffs` subdirectory of `store`, under the name
+        `<sha256>.patch.gz`, and the diff is replaced by a dictionary with its
+        `sha256`, uncompressed `size` and `path`. If the diff is larger than
+        `max_diff_size`, it is not kept, and is replaced by a dictionary with
+        a `numstat` per-file summary of the changes (`path`, and numbers of
+        `added` and `deleted` lines, None for binary files).
+
+        :param diff:  if True and uncommited changes are present in the
+                      repository, the diff is included in a patchable form.
+        :param store:          directory where to store the diff. If None, the
+                               diff is returned as a string.
+        :param max_diff_size:  maximum size of the diff, in bytes. If None, no
+                               limit is applied.
+        :return:      a dictionary with the `hash` of the HEAD commit, `dirty`
+                      (True if tracked files have uncommitted changes),
+                      `untracked` (True if untracked files are present), the
+                      git `version`, the `diff`, and `elapsed`, the time spent,
+                      in seconds.
         :raise FileNotFoundError:  if the path does not exist.
         :raise RepositoryNotFound: if no repository was found.
         """
+        start = time.perf_counter()
         repo = cls._get_repo(path)
+
+        profiling.count('subprocesses')
+        status = repo.git.status('--porcelain=v2', '--branch',
+                                 '--untracked-files=normal')
+        head, dirty, untracked = _parse_git_status(status)
+
         patch = None
-        if diff and repo.is_dirty(untracked_files=False):
-            t = repo.head.commit.tree
-            patch = repo.git.diff(t, patch=True)
+        if diff and dirty and head is not None:
+            patch = cls._git_diff(repo, head, store=store, max_size=max_diff_size)
+
+        return {'hash': head, 'dirty': dirty, 'untracked': untracked,
+                'version': cls._git_version(path), 'diff': patch,
+                'elapsed': time.perf_counter() - start}
 
-        git_version = git.cmd.Git(path).version()
+    @classmethod
+    def _git_diff(cls, repo, head, store=None, max_size=None):
+        """Stream the diff between `head` and the working tree.
+
+        See `git_snapshot` for the possible return values.
+        """
+        profiling.count('subprocesses')
+        if store is None and max_size is None:
+            return repo.git.diff(head, patch=True)
 
-        return {'hash': repo.head.object.hexsha, 'dirty': repo.is_dirty(),
-                'version': git_version, 'diff': patch}
+        writer = _DiffWriter(store=store, max_size=max_size)
+        proc = repo.git.diff(head, patch=True, as_process=True)
+        complete = False
+        try:
+            for chunk in iter(lambda: proc.stdout.read(_BUFFER_SIZE), b''):
+                if not writer.write(chunk):
+                    break
+            else:
+                complete = True
+        finally:
+            if not complete:
+                proc.proc.kill()
+                writer.abort()
+            proc.proc.wait()
+            proc.stdout.close()
+        if complete and proc.proc.returncode != 0:
+            import git
+            writer.abort()
+            raise git.GitCommandError(['git', 'diff', head],
+                                      proc.proc.returncode)
+
+        if writer.truncated:
+            profiling.count('subprocesses')
+            numstat = _parse_git_numstat(repo.git.diff(head, numstat=True))
+            return {'truncated': True, 'max_size': max_size, 'numstat': numstat}
+        return writer.finish()
 
     @classmethod
+    @profiling.instrumented
     def git_dirty(cls, path, allow_untracked=False):
         """
         Return True if the repository is dirty.
@@ -218,7 +1328,18 @@ class Context:
         :raise FileNotFoundError:  if the path does not exist.
         :raise RepositoryNotFound: if no repository was found.
         """
-        return cls._get_repo(path).is_dirty(untracked_files=not allow_untracked)
+        snapshot = cls.git_snapshot(path, diff=False)
+        return snapshot['dirty'] or (snapshot['untracked'] and not allow_untracked)
+
+    @classmethod
+    def _git_version(cls, path):
+        """Return the version of git, as reported by `git version`"""
+        path = os.path.abspath(path)
+        if path not in _git_versions:
+            import git
+            profiling.count('subprocesses')
+            _git_versions[path] = git.cmd.Git(path).version()
+        return _git_versions[path]
 
     @classmethod
     def _get_repo(cls, path, search_parent_directories=True):
@@ -231,20 +1352,28 @@ class Context:
         """
         if not os.path.exists(path):
             raise FileNotFoundError("'{}' not found".format(path))
-        try: # are we in a git repository?
-            return git.Repo(path,
+        key = (os.path.abspath(path), search_parent_directories)
+        if key not in _repos:
+            import git
+            try: # are we in a git repository?
+                _repos[key] = git.Repo(path,
                             search_parent_directories=search_parent_directories)
-        except git.InvalidGitRepositoryError: # not in a git repo
-            raise RepositoryNotFound("git repository not found "
-                                     "at '{}'".format(path))
+            except git.InvalidGitRepositoryError: # not in a git repo
+                raise RepositoryNotFound("git repository not found "
+                                         "at '{}'".format(path))
+        return _repos[key]
 
 
     ## Input & Output files
 
-    def add_file(self, path, category='', already=True):
+    @profiling.instrumented
+    def add_file(self, path, category='', already=True, strict=False):
         """
         Compute and store the SHA256 hash of a file, as well as its modification
-        time (mtime).
+        time (mtime) and size.
+
+        If the context has a hash cache, and the file was not modified since it
+        was last hashed, the cached digest is used and the file is not read.
 
         :param path:        the path to the file.
         :param category:    group label for the file, for instance 'input',
@@ -259,6 +1388,8 @@ class Context:
                             different categories (presumably 'input' and
                             'output' in this case). If `False`, the existing
                             entry, if any, will be overwritten.
+        :param strict:      if `True`, the hash cache is ignored, and the file
+                            is always read and hashed.
         :return:            The computed sha256 of the file.
         :raise ValueError:  if `already` is False and the file was previously
                             added (same string path), raise ValueError.
@@ -268,18 +1399,195 @@ class Context:
                             paths.
         """
         path = os.path.normpath(path)
-        if ((not already) and 'files' in self.data
-            and category in self.data['files']
-            and path in self.data['files'][category]):
+        self._check_already(path, category, already)
+        file_info = self._file_info(path, strict=strict)
+        self._set(('files', category, path), file_info)
+
+        return file_info['sha256']
+
+    @profiling.instrumented
+    def add_files(self, paths, category='', already=True, strict=False,
+                  workers=None):
+        """
+        Compute and store the SHA256 hash and mtime of multiple files.
+
+        This is the batch version of `add_file`: the files are hashed
+        concurrently, by a pool of `workers` threads, and the tracked data is
+        only updated once all files have been successfully hashed.
+
+        :param paths:       the paths to the files.
+        :param category:    group label for the files. See `add_file`.
+        :param already:     see `add_file`.
+        :param strict:      if `True`, the hash cache is ignored, and the files
+                            are always read and hashed.
+        :param workers:     number of threads used to hash the files. If None,
+                            a default based on the number of CPUs is used. If 1,
+                            the files are hashed sequentially.
+        :return:            a dictionary mapping each (normalized) path to the
+                            SHA256 of the file.
+        :raise ValueError:  if `already` is False and one of the files was
+                            previously added.
+        """
+        paths = [os.path.normpath(path) for path in paths]
+        for path in paths:
+            self._check_already(path, category, already)
+
+        def file_info(path):
+            return self._file_info(path, strict=strict)
+
+        infos = _parallel_map(file_info, paths, workers=workers)
+
+        self._update(('files', category), dict(zip(paths, infos)))
+
+        return {path: info['sha256'] for path, info in zip(paths, infos)}
+
+    def _check_already(self, path, category, already):
+        if ((not already) and 'files' in self._data
+            and category in self._data['files']
+            and path in self._data['files'][category]):
             raise ValueError("the '{}' file '{}' is already tracked".format(
                                                                 category, path))
-        file_info = {'sha256': self.sha256(path),
-                     'mtime': os.path.getmtime(path)}
-        self.data.setdefault('files', {})
-        self.data['files'].setdefault(category, {})
-        self.data['files'][category][path] = file_info
 
-        return file_info['sha256']
+    def _file_info(self, path, strict=False):
+        cache = None if strict else self.hash_cache
+        st = os.stat(path)
+        return {'sha256': self.sha256(path, cache=cache),
+                'mtime': st.st_mtime, 'size': st.st_size}
+
+    @profiling.instrumented
+    def add_directory(self, path, category='', include=None, exclude=None,
+                      manifest=None, strict=False, workers=None):
+        """
+        Compute and store the Merkle root of a directory tree.
+
+        Instead of tracking each file of the tree individually, as `add_file`
+        would, a single digest is computed for the whole tree: the digest of a
+        file is its SHA256, as computed by `sha256`, and the digest of a
+        directory is the SHA256 of the sorted list of the names, types and
+        digests of its entries. Only regular files are considered; symbolic
+        links to directories are not followed, and directories that do not
+        contain any included file are ignored.
+
+        The full per-file manifest can be saved in a JSON sidecar file. If the
+        sidecar already exists, it is used to update the tree incrementally:
+        only the files whose stat information (size, mtime, ctime, inode)
+        changed are hashed again, and only the directories containing them
+        have their digest recomputed.
+
+        :param path:      the path to the directory.
+        :param category:  group label for the directory, for instance 'input'.
+        :param include:   list of glob patterns, matched against the paths
+                          relative to `path` (with '/' as separator). If not
+                          None, only the files matching at least one of the
+                          patterns are included.
+        :param exclude:   list of glob patterns. Files and directories matching
+                          any of the patterns are excluded.
+        :param manifest:  path to the JSON manifest sidecar file. If None, no
+                          manifest is read or written.
+        :param strict:    if `True`, the manifest and hash cache are ignored,
+                          and every file is read and hashed.
+        :param workers:   number of threads used to hash the files. See
+                          `add_files`.
+        :return:          the Merkle root of the directory, as a hexadecimal
+                          string.
+        :raise FileNotFoundError:  if the directory does not exist.
+        """
+        path = os.path.normpath(path)
+        if not os.path.isdir(path):
+            raise FileNotFoundError('directory {} was not found'.format(path))
+        files = self._scan_directory(path, include, exclude)
+
+        previous = {}
+        if manifest is not None and not strict and os.path.isfile(manifest):
+            with open(manifest, 'r') as f:
+                previous = json.load(f)
+            if previous.get('path') != path:
+                previous = {}
+        prev_files = previous.get('files', {})
+        prev_dirs  = previous.get('directories', {})
+
+        entries, to_hash = {}, []
+        for relpath, st in files.items():
+            stat = [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]
+            entries[relpath] = {'stat': stat, 'sha256': None}
+            old = prev_files.get(relpath)
+            if old is not None and old['stat'] == stat:
+                entries[relpath]['sha256'] = old['sha256']
+            else:
+                to_hash.append(relpath)
+
+        cache = None if strict else self.hash_cache
+        def sha256(relpath):
+            return self.sha256(os.path.join(path, relpath), cache=cache)
+        digests = _parallel_map(sha256, to_hash, workers=workers)
+        for relpath, digest in zip(to_hash, digests):
+            entries[relpath]['sha256'] = digest
+
+        # directories that need their digest recomputed.
+        changed = set(to_hash).union(set(prev_files).difference(entries))
+        dirty = set()
+        for relpath in changed:
+            while relpath:
+                relpath = relpath.rpartition('/')[0]
+                dirty.add(relpath)
+
+        # entries of each directory, as (name, kind, relative path) tuples.
+        children = {'': []}
+        for relpath in entries:
+            kind, child = 'f', relpath
+            while child:
+                parent, _, name = child.rpartition('/')
+                known_parent = parent in children
+                children.setdefault(parent, []).append((name, kind, child))
+                if known_parent:
+                    break
+                kind, child = 'd', parent
+
+        directories = {}
+        for dirpath in sorted(children, key=lambda d: d.count('/') + bool(d),
+                              reverse=True):
+            if dirpath not in dirty and dirpath in prev_dirs:
+                directories[dirpath] = prev_dirs[dirpath]
+                continue
+            node = hashlib.sha256()
+            for name, kind, child in sorted(children[dirpath]):
+                digest = entries[child]['sha256'] if kind == 'f' else directories[child]
+                node.update('{} {} {}\n'.format(kind, digest, name).encode())
+            directories[dirpath] = node.hexdigest()
+
+        merkle_root = directories['']
+        if manifest is not None:
+            with AtomicWriter(manifest, encoding='utf-8') as f:
+                json.dump({'path': path, 'merkle_root': merkle_root,
+                           'files': entries, 'directories': directories},
+                          f, sort_keys=True)
+
+        self._set(('directories', category, path), {
+            'merkle_root': merkle_root, 'files': len(entries),
+            'size': sum(entry['stat'][0] for entry in entries.values()),
+            'manifest': manifest})
+        return merkle_root
+
+    @classmethod
+    def _scan_directory(cls, path, include=None, exclude=None):
+        """Return a {relative path: stat} dictionary of the files under `path`"""
+        def match(relpath, patterns):
+            return any(fnmatch.fnmatchcase(relpath, p) for p in patterns)
+
+        files, stack = {}, ['']
+        while stack:
+            reldir = stack.pop()
+            with os.scandir(os.path.join(path, reldir)) as it:
+                for entry in it:
+                    relpath = entry.name if not reldir else reldir + '/' + entry.name
+                    if exclude and match(relpath, exclude):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(relpath)
+                    elif entry.is_file():
+                        if include is None or match(relpath, include):
+                            files[relpath] = entry.stat()
+        return files
 
     def untrack_file(self, path, category='', notfound_ok=False):
         """
@@ -297,43 +1605,593 @@ class Context:
         path = os.path.normpath(path)
         notfound = False
         try:
-            self.data['files'][category].pop(path)
+            self._data['files'][category].pop(path)
+            self._log({'op': 'del', 'keys': ('files', category, path)})
         except KeyError:
             if not notfound_ok:
                 raise ValueError(('the `{}` file was not found as tracked in '
                                   'category {}.').format(path, category))
 
+    @profiling.instrumented
+    def verify(self, record=None, strict=False, workers=None):
+        """Check that the tracked files still match their recorded state.
+
+        By default, a file whose size and mtime are the same as recorded is
+        trusted to be unchanged, without being read. Other files are hashed
+        again, concurrently, and compared to their recorded SHA256.
+
+        :param record:   the record whose files to verify: a `Context`
+                         instance, a dictionary of tracked data, or the path
+                         to an exported record. If None, the files tracked by
+                         this context are verified.
+        :param strict:   if True, every file is read and hashed again, and the
+                         hash cache is ignored.
+        :param workers:  number of threads used to hash the files. See
+                         `add_files`.
+        :return:         a `VerificationReport` instance.
+        """
+        if record is None:
+            record = self.data
+        elif isinstance(record, Context):
+            record = record.data
+        elif not isinstance(record, dict):
+            record = self.load(record)
+        entries = [(category, path, info)
+                   for category, files in sorted((record.get('files') or {}).items())
+                   for path, info in sorted(files.items())]
+        cache = None if strict else self.hash_cache
+
+        def check(entry):
+            category, path, info = entry
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return 'missing', 0
+            if (not strict and st.st_mtime == info.get('mtime')
+                and st.st_size == info.get('size', st.st_size)):
+                return 'unchanged', 0
+            try:
+                sha256 = self.sha256(path, cache=cache)
+            except FileNotFoundError:  # a directory, or removed in between
+                return 'missing', 0
+            status = 'unchanged' if sha256 == info.get('sha256') else 'modified'
+            return status, st.st_size
+
+        start = time.perf_counter()
+        results = _parallel_map(check, entries, workers=workers)
+        report = {'unchanged': [], 'modified': [], 'missing': []}
+        for (category, path, _), (status, _) in zip(entries, results):
+            report[status].append((category, path))
+        return VerificationReport(bytes_read=sum(n for _, n in results),
+                                  elapsed=time.perf_counter() - start, **report)
+
     @classmethod
-    def sha256(cls, path):
-        """Compute the SHA256 hash of a file"""
+    @profiling.instrumented
+    def sha256(cls, path, cache=None):
+        """Compute the SHA256 hash of a file
+
+        :param cache:  a `HashCache` instance. If provided, and the file was not
+                       modified since it was last hashed, the cached digest is
+                       returned without reading the file.
+        """
         if not os.path.isfile(path):
             raise FileNotFoundError('file {} was not found'.format(path))
+        if cache is not None:
+            st = os.stat(path)
+            digest = cache.get(st)
+            if digest is not None:
+                return digest
         hash_sha256 = hashlib.sha256()
-        with open(path, "rb") as f:
+        buf = getattr(_buffers, 'buffer', None)
+        if buf is None:
+            buf = _buffers.buffer = memoryview(bytearray(_BUFFER_SIZE))
+        with open(path, "rb", buffering=0) as f:
             # reading incrementally, in case it does not fit in memory.
-            for block in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(block)
-        return hash_sha256.hexdigest()
+            for n in iter(lambda: f.readinto(buf), 0):
+                hash_sha256.update(buf[:n])
+                profiling.count('bytes_read', n)
+        digest = hash_sha256.hexdigest()
+        # only cache the digest if the file was not modified while being read.
+        if cache is not None and stat_key(os.stat(path)) == stat_key(st):
+            cache.set(st, digest)
+        return digest
+
+
+    ## Comparison
+
+    def compare(self, other, ignore=('timestamp', '_profile')):
+        """Compare the tracked data with another record.
+
+        The comparison is structural: packages are matched by name, files by
+        category and path, repositories by path, CPU flags are compared as
+        sets, etc. Tuples and lists are considered equivalent, so that data
+        loaded from a JSON or YAML export compares equal to the original.
+
+        :param other:   the other record: a `Context` instance, a dictionary
+                        of tracked data, or the path to an exported record.
+        :param ignore:  top-level sections of the data to ignore.
+        :return:        a `RecordDiff` instance, listing the changes from this
+                        context's data to the other record. Use its `summary()`
+                        method for a human-readable summary.
+        """
+        from .comparison import compare
+        if isinstance(other, Context):
+            other = other.data
+        elif not isinstance(other, dict):
+            other = self.load(other)
+        return compare(self.data, other, ignore=ignore)
+
+
+    ## Profiling
+
+    def add_profile_hook(self, hook):
+        """Call a function after each profiled call of a collector.
+
+        Profiling is enabled, if it was not already (see the `profile`
+        argument of `Context`). Hooks are meant to forward the measures to a
+        metrics system; they are not pickled with the context, and an
+        exception raised by a hook propagates to the caller of the collector.
+
+        :param hook:  a function, called as `hook(name, measures)`, with the
+                      name of the collector (e.g. 'sha256', 'git_snapshot' or
+                      'export_json'), and a dictionary with the `wall` and
+                      `cpu` time of the call, in seconds, the `bytes_read`,
+                      and the number of `subprocesses` run.
+        """
+        if self._profile is None:
+            self._profile = profiling.Profile()
+        self._profile.hooks.append(hook)
+
+    def remove_profile_hook(self, hook):
+        """Remove a hook added with `add_profile_hook`.
+
+        :raise ValueError:  if the hook was not added.
+        """
+        if self._profile is None or hook not in self._profile.hooks:
+            raise ValueError('{!r} is not a profile hook'.format(hook))
+        self._profile.hooks.remove(hook)
+
+
+    ## Fork and Merge
+
+    def fork(self, name=None):
+        """Create a child context, that records only what is added to it.
+
+        The child context has the same settings as this one (hash cache,
+        store, ...), but its data is initially empty: the environment is not
+        collected again. It is cheap to pickle, and can therefore be sent to,
+        and back from, `multiprocessing` or `concurrent.futures` workers, which
+        record their files, data, repositories or random state in it. The
+        children are then combined with `merge`.
+
+        :param name:  name of the child. If None, the number of the child, e.g.
+                      '0' for the first child, prefixed by the name of this
+                      context if it is itself a child, e.g. '0.1'.
+        :return:      the child `Context`.
+        """
+        if name is None:
+            name = str(self._fork_count)
+            if self.fork_name is not None:
+                name = '{}.{}'.format(self.fork_name, name)
+        self._fork_count += 1
+        child = type(self).__new__(type(self))
+        child.__dict__.update(self.__dict__)
+        child.__dict__.update(_data={}, _pending=[], _journal=None,
+                              _executor=None, _semaphore=None, _recorders=[],
+                              background=False, fork_name=name, _fork_count=0)
+        if self._profile is not None:
+            child._profile = profiling.Profile(self._profile.hooks)
+        return child
+
+    def merge(self, children):
+        """Merge the data recorded by child contexts into this context.
+
+        Files, directories, repositories and user data are merged entry by
+        entry. If two children, or a child and this context, recorded
+        different values for the same entry (e.g. different hashes for the
+        same file in the same category), nothing is merged and `MergeConflict`
+        is raised. Identical values are not a conflict. The other data of a
+        child, such as its random state, is kept separately, under
+        `data['forks'][name]`.
+
+        The result only depends on the order of `children`, not on the order
+        in which they completed.
+
+        :param children:  contexts created by `fork`.
+        :raise MergeConflict:  if children recorded different values for the
+                               same entry.
+        """
+        changes, conflicts = {}, []
+        for child in children:
+            for keys, value in self._fork_entries(child):
+                current = changes.get(keys, _missing)
+                if current is _missing:
+                    current = self._get(keys)
+                if current is _missing or current == value:
+                    changes[keys] = value
+                else:
+                    conflicts.append((keys, current, value))
+        if conflicts:
+            raise MergeConflict(conflicts)
+
+        grouped = {}
+        for keys, value in changes.items():
+            grouped.setdefault(keys[:-1], {})[keys[-1]] = value
+        for keys, values in grouped.items():
+            self._update(keys, values)
+
+    @classmethod
+    def _fork_entries(cls, child):
+        """Yield the `(keys, value)` entries of the data of a child."""
+        for section, value in child.data.items():
+            depth = _MERGED_SECTIONS.get(section)
+            if depth is None:
+                yield ('forks', child.fork_name, section), value
+                continue
+            queue = collections.deque([((section,), value)])
+            while queue:
+                keys, value = queue.popleft()
+                if len(keys) > depth:
+                    yield keys, value
+                else:
+                    queue.extend((keys + (key,), v) for key, v in value.items())
+
+    def _get(self, keys):
+        """Return the value at the path `keys` of the tracked data, or
+        `_missing`."""
+        target = self.data
+        for key in keys:
+            if not isinstance(target, dict) or key not in target:
+                return _missing
+            target = target[key]
+        return target
+
+
+    ## Journal
+
+    def open_journal(self, path, sync_every=100, sync_interval=1.0):
+        """Record every change to the tracked data in an append-only journal.
+
+        For long-running computations, this allows to save the tracked data
+        progressively, at a constant cost per change, rather than exporting
+        the whole data again at each checkpoint, and to recover it after a
+        crash. The current data is written first, and then every change made
+        through the reproducible methods (`add_file`, `add_data`, etc.) is
+        appended as one JSON line. Changes made by directly modifying `data`
+        are not recorded.
+
+        The journal is synced to disk by batch: every `sync_every` changes, or
+        after `sync_interval` seconds. Use `load_journal` or `compact_journal`
+        to rebuild the tracked data from the journal.
+
+        :param path:           path to the journal file. If the file exists,
+                               the changes are appended to it.
+        :param sync_every:     maximum number of changes between two syncs.
+        :param sync_interval:  maximum time between two syncs, in seconds.
+        :raise TypeError:  if some of the data is not JSON serializable.
+        """
+        self.close_journal()
+        self._journal = Journal(path, sync_every=sync_every,
+                                sync_interval=sync_interval)
+        # data being collected in the background is journaled when it lands.
+        self._log({'op': 'reset', 'data': self._data})
+
+    def close_journal(self):
+        """Sync and close the journal, if one is open."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    @classmethod
+    def load_journal(cls, path):
+        """Rebuild the tracked data from a journal.
+
+        An incomplete last entry, as left by a crash, is ignored.
+
+        :return:  the tracked data, as a dictionary. Tuples are returned as
+                  lists.
+        """
+        return replay(path)
+
+    @classmethod
+    def compact_journal(cls, path, output=None):
+        """Compact a journal, and optionally export its tracked data.
+
+        The journal is replaced by a journal holding only the final state of
+        the tracked data. The journal must not be open for writing.
+
+        :param path:    path to the journal file.
+        :param output:  if not None, path to a JSON file to export the tracked
+                        data to.
+        :return:        the tracked data, as a dictionary.
+        """
+        data = replay(path)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        journal = Journal(tmp_path)
+        journal.append({'op': 'reset', 'data': data})
+        journal.close()
+        os.replace(tmp_path, path)
+        if output is not None:
+            _write_bytes(output, _dumps_json(data).encode('utf-8'))
+        return data
+
+
+    ## Asynchronous functions
+
+    # These are awaitable counterparts of the recording and export functions,
+    # for use in asyncio programs. File hashing and writing run in a bounded
+    # pool of threads, and git runs in asyncio subprocesses, so that they do
+    # not block the event loop. The tracked data is only modified from the
+    # event loop thread.
+
+    def _async_limit(self):
+        if self.async_workers is not None:
+            return self.async_workers
+        return min(32, (os.cpu_count() or 1) + 4)
+
+    async def _arun(self, func, *args):
+        """Run `func(*args)` in the thread pool of the asynchronous functions."""
+        import asyncio
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self._async_limit())
+        return await asyncio.get_event_loop().run_in_executor(
+                                                 self._executor, func, *args)
+
+    def _async_semaphore(self):
+        """Return the semaphore bounding the number of git subprocesses."""
+        import asyncio
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self._async_limit()))
+        return self._semaphore[1]
+
+    async def _afinalize(self):
+        """Wait, without blocking the event loop, for the data collected in the
+        background (see the `background` parameter of `Context`)."""
+        import asyncio
+        for _, future in list(self._pending):
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass  # raised by `_finalize`.
+
+    async def aadd_file(self, path, category='', already=True, strict=False):
+        """Asynchronous version of `add_file`.
+
+        The file is hashed in a worker thread.
+        """
+        path = os.path.normpath(path)
+        self._check_already(path, category, already)
+        info = await self._arun(self._file_info, path, strict)
+        self._set(('files', category, path), info)
+        return info['sha256']
+
+    async def aadd_files(self, paths, category='', already=True, strict=False):
+        """Asynchronous version of `add_files`.
+
+        The files are hashed concurrently by the worker threads, whose number
+        is bounded by the `async_workers` parameter of the context.
+        """
+        import asyncio
+        paths = [os.path.normpath(path) for path in paths]
+        for path in paths:
+            self._check_already(path, category, already)
+        infos = await asyncio.gather(*(self._arun(self._file_info, path, strict)
+                                       for path in paths))
+        self._update(('files', category), dict(zip(paths, infos)))
+        return {path: info['sha256'] for path, info in zip(paths, infos)}
+
+    async def aadd_repo(self, path='.', allow_dirty=False, allow_untracked=False,
+                        diff=True):
+        """Asynchronous version of `add_repo`.
+
+        git is run in asyncio subprocesses, at most `async_workers` at a time.
+        """
+        async with self._async_semaphore():
+            snapshot = await self.agit_snapshot(path, diff=diff and allow_dirty,
+                                                store=self.store,
+                                                max_diff_size=self.max_diff_size)
+        if (not allow_dirty) and (snapshot['dirty'] or
+                                  (snapshot['untracked'] and not allow_untracked)):
+            raise RepositoryDirty("Repository '{}' is in a dirty state".format(path))
+        self._set(('repositories', path), self._git_record(snapshot))
+
+    @classmethod
+    async def agit_snapshot(cls, path, diff=True, store=None, max_diff_size=None):
+        """Asynchronous version of `git_snapshot`.
+
+        git is run directly, in asyncio subprocesses, rather than through
+        GitPython.
+
+        :raise FileNotFoundError:  if the path does not exist.
+        :raise RepositoryNotFound: if no repository was found.
+        """
+        start = time.perf_counter()
+        if not os.path.exists(path):
+            raise FileNotFoundError("'{}' not found".format(path))
+        cwd = path if os.path.isdir(path) else (os.path.dirname(path) or '.')
+
+        status = await _agit(cwd, 'status', '--porcelain=v2', '--branch',
+                             '--untracked-files=normal')
+        head, dirty, untracked = _parse_git_status(status)
+
+        patch = None
+        if diff and dirty and head is not None:
+            patch = await cls._agit_diff(cwd, head, store=store,
+                                         max_size=max_diff_size)
+
+        key = os.path.abspath(cwd)
+        if key not in _git_versions:
+            _git_versions[key] = (await _agit(cwd, 'version')).strip()
+
+        return {'hash': head, 'dirty': dirty, 'untracked': untracked,
+                'version': _git_versions[key], 'diff': patch,
+                'elapsed': time.perf_counter() - start}
+
+    @classmethod
+    async def _agit_diff(cls, cwd, head, store=None, max_size=None):
+        """Asynchronous version of `_git_diff`."""
+        import asyncio
+        writer = _DiffWriter(store=store, max_size=max_size)
+        proc = await asyncio.create_subprocess_exec(
+                    'git', 'diff', '--patch', head, cwd=cwd,
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        loop, complete = asyncio.get_event_loop(), False
+        try:
+            while True:
+                chunk = await proc.stdout.read(_BUFFER_SIZE)
+                if not chunk:
+                    complete = True
+                    break
+                if store is not None:  # compression is not negligible.
+                    written = await loop.run_in_executor(None, writer.write, chunk)
+                else:
+                    written = writer.write(chunk)
+                if not written:
+                    break
+        finally:
+            if not complete:
+                if proc.returncode is None:
+                    proc.kill()
+                writer.abort()
+            await proc.wait()
+        if complete and proc.returncode != 0:
+            writer.abort()
+            raise subprocess.CalledProcessError(proc.returncode,
+                                                ['git', 'diff', head])
+
+        if writer.truncated:
+            numstat = _parse_git_numstat(await _agit(cwd, 'diff', '--numstat', head))
+            return {'truncated': True, 'max_size': max_size, 'numstat': numstat}
+        return writer.finish()
+
+    async def aadd_pip_packages(self, cache=True):
+        """Asynchronous version of `add_pip_packages`.
+
+        The packages are gathered in a worker thread.
+        """
+        packages = await self._arun(self._pip_freeze, cache)
+        self._set(('packages',), packages)
+        return packages
+
+    async def _aexport(self, path, update_timestamp, encode=None,
+                       serialize=None, compression=None):
+        """Export the tracked data to `path`; return the SHA256 of the file.
+
+        The exported record must be consistent even if other tasks keep
+        modifying the data. So the data is either encoded in the event loop
+        by `encode`, when that is fast, or copied there, and the copy is
+        serialized by `serialize` in a worker thread. `encode` returns the
+        encoded data, as bytes, or None if it cannot encode it fast, and
+        `serialize` returns the encoded data. The encoded data is compressed
+        (see `_compress`), written and hashed in a worker thread.
+        """
+        await self._afinalize()
+        if update_timestamp:
+            self._set(('timestamp',), self._timestamp())
+        content = encode(self.data) if encode is not None else None
+        data = copy.deepcopy(self.data) if content is None else None
+        def export():
+            encoded = serialize(data) if content is None else content
+            return _write_bytes(path, _compress(encoded, compression))
+        return await self._arun(export)
+
+    async def aexport_json(self, path, update_timestamp=False):
+        """Asynchronous version of `export_json`.
+
+        The event loop is blocked only while the data is encoded with orjson,
+        if it is installed, which is fast. Else, the data is copied, which is
+        faster than encoding it with the `json` module, and the copy is
+        encoded in a worker thread. The file is written and hashed in a
+        worker thread.
+        """
+        return await self._aexport(
+                   path, update_timestamp, encode=_orjson_dumps,
+                   serialize=lambda data: _dumps_json(data, fast=False).encode('utf-8'))
+
+    async def aexport_yaml(self, path, update_timestamp=False):
+        """Asynchronous version of `export_yaml`.
+
+        The data is copied in the event loop, and the copy serialized in a
+        worker thread, as PyYAML is slow. The file is written and hashed in a
+        worker thread.
+
+        :raise ImportError:  if the `yaml` module cannot be imported.
+        """
+        _import_yaml()  # fail early.
+        return await self._aexport(
+                   path, update_timestamp,
+                   serialize=lambda data: _dumps_yaml(data).encode('utf-8'))
+
+    async def aexport_msgpack(self, path, compression='xz',
+                              update_timestamp=False):
+        """Asynchronous version of `export_msgpack`.
+
+        The data is encoded with msgpack in the event loop, which is fast, and
+        compressed, written and hashed in a worker thread.
+
+        :raise ImportError:  if the `msgpack` module, or the `zstandard` module
+                             for zstd compression, cannot be imported.
+        """
+        _import_msgpack()
+        return await self._aexport(path, update_timestamp,
+                                   encode=_dumps_msgpack, compression=compression)
 
 
     ## Export functions
 
+    def digest(self, ignore=()):
+        """Return the SHA256 of the canonical encoding of the tracked data.
+
+        Unlike the SHA256 of an exported file, the digest does not depend on
+        the format or the formatting of the export: equal data always have
+        the same digest, which can serve as an identifier of the record. The
+        canonical encoding is JSON, in UTF-8, with sorted keys and no
+        whitespace; tuples are encoded as lists. It is hashed as it is
+        produced, without building the whole encoding in memory. The timings
+        of the `_profile` section (see the `profile` argument of `Context`)
+        are not part of the record, and are always left out.
+
+        :param ignore:  top-level sections of the data to leave out of the
+                        digest, e.g. `('timestamp',)`, so that records of
+                        identical runs have the same digest.
+        :raise TypeError:   if some of the data is not JSON serializable.
+        :raise ValueError:  if the data contains NaN or infinite floats.
+        """
+        ignore = ('_profile',) + tuple(ignore)
+        data = {key: value for key, value in self.data.items()
+                if key not in ignore}
+        digest = hashlib.sha256()
+        for chunk in _canonical_chunks(data):
+            digest.update(chunk.encode('utf-8'))
+        return digest.hexdigest()
+
     def json(self, update_timestamp=False):
         """Return the current tracking data, formated as JSON, as a string.
 
+        The orjson library is used, if it is installed, for faster encoding.
+        Use `digest` to identify the data independently of its formatting.
+
         :param update_timestamp: if True, update the timestamp of the tracked
                                  data. Default False.
         """
         if update_timestamp:
-            self.data['timestamp'] = self._timestamp()
-        return json.dumps(self.data, sort_keys=True, indent=2)
+            self._set(('timestamp',), self._timestamp())
+        return _dumps_json(self.data)
 
+    @profiling.instrumented
     def export_json(self, path, update_timestamp=False):
         """Export the tracked data as a JSON file
 
         Will raise error if some of the data is not JSON serializable. This
         method will return the SHA256 hexadecimal string of the saved file.
 
+        As all export functions, the file is written in a temporary file, and
+        renamed once complete: it is never seen partially written, and is left
+        untouched if the export fails. The SHA256 is computed as the file is
+        written, without reading it back.
+
         :param path:              Path to the file to save the JSON data to.
                                   If the file exists, it will be overwritten.
         :param update_timestamp:  The global timestamp of the tracked data, is
@@ -344,10 +2202,8 @@ class Context:
                                   of the call to `export_json`.
         """
         if update_timestamp:
-            self.data['timestamp'] = self._timestamp()
-        with open(path, 'w') as f:
-            json.dump(self.data, f, sort_keys=True, indent=2)
-        return self.sha256(path)
+            self._set(('timestamp',), self._timestamp())
+        return _write_bytes(path, _dumps_json(self.data).encode('utf-8'))
 
 
 
@@ -357,10 +2213,12 @@ class Context:
         :param update_timestamp: if True, update the timestamp of the tracked
                                  data. Default False.
         """
+        _import_yaml()
         if update_timestamp:
-            self.data['timestamp'] = self._timestamp()
-        return yaml.safe_dump(self.data, indent=2, allow_unicode=True)
+            self._set(('timestamp',), self._timestamp())
+        return _dumps_yaml(self.data)
 
+    @profiling.instrumented
     def export_yaml(self, path=None, update_timestamp=False):
         """Export the tracked data as a YAML file
 
@@ -377,82 +2235,225 @@ class Context:
                                   the call to `export_yaml`.
         :raise ImportError:  if the `yaml` module cannot be imported.
         """
-        if not yaml_available:
-            raise ImportError('PyYAML does not seem present or importable.')
+        yaml = _import_yaml()
         if update_timestamp:
-            self.data['timestamp'] = self._timestamp()
-        with open(path, 'w') as f:
+            self._set(('timestamp',), self._timestamp())
+        with AtomicWriter(path, encoding='utf-8') as f:
             yaml.safe_dump(self.data, f, indent=2, allow_unicode=True)
-        return self.sha256(path)
+        return f.sha256
+
+
+    def msgpack(self, update_timestamp=False):
+        """Return the current tracking data, encoded with msgpack, as bytes.
+
+        Tuples are preserved, rather than being converted to lists. They are
+        encoded as a `{'__type__': 'tuple', 'value': [...]}` map.
+
+        :param update_timestamp: if True, update the timestamp of the tracked
+                                 data. Default False.
+        :raise ImportError:  if the `msgpack` module cannot be imported.
+        """
+        _import_msgpack()
+        if update_timestamp:
+            self._set(('timestamp',), self._timestamp())
+        return _dumps_msgpack(self.data)
+
+    @profiling.instrumented
+    def export_msgpack(self, path, compression='xz', update_timestamp=False):
+        """Export the tracked data as a compressed msgpack file
+
+        msgpack is a compact binary format, faster to write and to read than
+        JSON or YAML. Tuples, such as the python version or the random state,
+        are preserved. Will raise error if some of the data is not msgpack
+        serializable. This method will return the SHA256 hexadecimal string of
+        the saved file. Use `load_msgpack` to read the file back.
+
+        :param path:              Path to the file to save the data to. No
+                                  extension is added. If the file exists, it
+                                  will be overwritten.
+        :param compression:       'xz', 'zstd' or None. 'zstd' requires the
+                                  `zstandard` package.
+        :param update_timestamp:  If True, the timestamp will become the date
+                                  of the call to `export_msgpack`.
+        :raise ImportError:  if the `msgpack` module, or the `zstandard` module
+                             for zstd compression, cannot be imported.
+        """
+        content = _compress(self.msgpack(update_timestamp=update_timestamp),
+                            compression)
+        return _write_bytes(path, content)
+
+    @classmethod
+    def load_msgpack(cls, path):
+        """Load tracking data exported by `export_msgpack`.
+
+        The compression is detected automatically.
+
+        :param path:  path of the msgpack file.
+        :return:      the tracking data, as a dictionary.
+        :raise ImportError:  if the `msgpack` module, or the `zstandard` module
+                             for a zstd-compressed file, cannot be imported.
+        """
+        msgpack = _import_msgpack()
+        with open(path, 'rb') as f:
+            content = f.read()
+        if content.startswith(_XZ_MAGIC):
+            import lzma
+            content = lzma.decompress(content)
+        elif content.startswith(_ZSTD_MAGIC):
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('zstandard does not seem present or importable.')
+            content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+        return msgpack.unpackb(content, raw=False, strict_map_key=False,
+                               object_hook=_msgpack_object_hook)
+
+    @classmethod
+    def load(cls, path):
+        """Load tracked data from an exported file, or from a journal.
+
+        The format is determined from the file content and extension: JSON
+        (`export_json`), YAML (`.yaml` or `.yml`, `export_yaml`), msgpack
+        (`export_msgpack`) or journal (`.jsonl`, `open_journal`).
+
+        :param path:  path of the file.
+        :return:      the tracked data, as a dictionary.
+        """
+        with open(path, 'rb') as f:
+            head = f.read(8)
+        ext = os.path.splitext(path)[1].lower()
+        if (head.startswith(_XZ_MAGIC) or head.startswith(_ZSTD_MAGIC)
+            or ext == '.msgpack'):
+            return cls.load_msgpack(path)
+        if ext == '.jsonl':
+            return cls.load_journal(path)
+        if ext in ('.yaml', '.yml'):
+            yaml = _import_yaml()
+            with open(path, 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
 
 
     ## Packages
 
     # TODO: support conda
 
-    def _pip_freeze(self):
-        output =  subprocess.check_output(['pip', 'freeze', '-qq'])
-        return output.decode().split('\n')[:-1]
+    @profiling.instrumented
+    def _pip_freeze(self, cache=True):
+        return _installed_packages(cache=cache)
 
-    def add_pip_packages(self):
+    def add_pip_packages(self, cache=True):
         """Gather and add the list of installed packages to the tracked data.
 
+        :param cache:  if False, the list is always gathered anew, rather than
+                       reusing a list gathered earlier, in this or another
+                       process, when no package was installed or removed since.
         :return:  the packages, as a list of strings.
 
-        This function calls `pip freeze`, which may be slow or absent, and this
-        may be undesirable in some environment. It must be called manually.
-        Note that `pip freeze` may report an incomplete or incorrect list.
+        The list is gathered from the metadata of the installed distributions,
+        and follows the format of `pip freeze`, including editable and direct
+        URL installs (PEP 610). On Python versions older than 3.8, `pip freeze`
+        is called instead. Note that the list may be incomplete or incorrect
+        for packages installed by other means than pip.
         """
-        self.data['packages'] = self._pip_freeze()
+        self._set(('packages',), self._pip_freeze(cache=cache))
         return self.data['packages']
 
-    def add_cpu_info(self):
+    @profiling.instrumented
+    def _cpu_info(self, cache=True):
+        return cpu_info(cache=cache)
+
+    def add_cpu_info(self, cache=True):
         """Gather detailed information about the CPU(s).
 
+        :param cache:  if True, the information is read from, or saved to, a
+                       cache in `~/.cache/reproducible`, valid until the next
+                       reboot of the machine. If False, it is always gathered
+                       anew.
         :return:  the information gathered about the CPU(s).
 
         Detailed information about the processor capabilities can be important,
         as optimized numerical libraries will use the CPU instruction sets as
         they are available, and therefore may behave differently on different
-        processors.
+        processors. Fields that vary between calls, such as the current CPU
+        frequency (`hz_actual`), are not included.
 
-        :remark:  this is a costly call (1-2 seconds).
+        :remark:  this is a costly call (1-2 seconds) when not cached.
         """
-        self.data['cpu_info'] = self._pip_freeze()
-        return self.data['cpu_info']
+        self._set(('cpuinfo',), self._cpu_info(cache=cache))
+        return self.data['cpuinfo']
 
 
     def find_editable_repos(self):
-        """Find editable repositories in the list of installed packages.
+        """Find the packages installed in editable mode, e.g. with
+        `pip install -e path/to/repo`.
+
+        The packages are found from the `direct_url.json` file of their
+        metadata (PEP 610), written by pip since version 20.1 (and, for
+        editable installs, by pip 21.3 or later). Editable installs of remote
+        repositories (`pip install -e git+https://...`) are not included, as
+        the metadata does not record where they were cloned.
 
         :return:  a list of (name, version, path) for each of the editable
-                  repository found.
-        :note:    this function is considered brittle, as it relies on the
-                  text output of the `pip freeze` command.
-        """
-        requirements = self.add_pip_packages()
-        editables = []
-        for i, r in enumerate(requirements):
-            if r.startswith('-e'):
-                desc = requirements[i - 1]
-                if desc.startswith('# '):
-                    reg_exp = '(.*)\\((?P<name>.+)\\=\\=(?P<version>.+)\\)'
-                    m = re.fullmatch(reg_exp, desc)
-                    assert m is not None
-                    name, version = m.group('name'), m.group('version')
-                    editables.append((name, version, r[3:]))
-        return editables
-
-    def add_editable_repos(self, allow_dirty=True, verbose=False):
-        """Track all editable repository found in the list of installed packages.
-
-        Invokes `add_repo()` on each repository found.
-        """
-        for editable in self.find_editable_repos():
-            name, version, path = editable
+                  package found. The path may not be in a git repository.
+        """
+        try:
+            return _editable_installs()
+        except ImportError:  # Python < 3.8: parse the `pip freeze` output.
+            requirements, editables = self._pip_freeze(cache=False), []
+            for desc, r in zip(requirements, requirements[1:]):
+                m = re.fullmatch(r'# .*\((?P<name>.+)==(?P<version>.+)\)', desc)
+                if m is not None and r.startswith('-e '):
+                    editables.append((m.group('name'), m.group('version'), r[3:]))
+            return editables
+
+    def add_editable_repos(self, allow_dirty=True, verbose=False,
+                           workers=None):
+        """Track the repositories of all the packages installed in editable
+        mode (see `find_editable_repos`).
+
+        The repositories are queried concurrently, as `add_repo()` would. A
+        repository that cannot be added does not prevent the others from
+        being added: the errors are returned instead of being raised.
+
+        :param allow_dirty:  if False, repositories with uncommitted changes or
+                             untracked files are not added, and a
+                             `RepositoryDirty` error is returned for them.
+        :param verbose:      if True, print each repository added, and each
+                             error.
+        :param workers:      number of threads querying the repositories. If
+                             None, the default of `ThreadPoolExecutor`.
+        :return:  a dictionary of the exceptions raised for each path that
+                  could not be added, e.g. `RepositoryNotFound` if the package
+                  is not in a git repository. Empty if all were added.
+        """
+        editables = self.find_editable_repos()
+        def snapshot(editable):
+            try:
+                return self.git_snapshot(editable[2], diff=allow_dirty,
+                                         store=self.store,
+                                         max_diff_size=self.max_diff_size)
+            except Exception as exc:
+                return exc
+        snapshots = _parallel_map(snapshot, editables, workers=workers)
+
+        errors = {}
+        for (name, version, path), snapshot in zip(editables, snapshots):
+            if (not allow_dirty and not isinstance(snapshot, Exception)
+                and (snapshot['dirty'] or snapshot['untracked'])):
+                snapshot = RepositoryDirty(
+                               "Repository '{}' is in a dirty state".format(path))
+            if isinstance(snapshot, Exception):
+                errors[path] = snapshot
+                if verbose:
+                    print('could not add editable repo {} ({}): {}'.format(
+                              name, path, snapshot))
+                continue
             if verbose:
                 print('adding editable repo {} ({})'.format(name, path))
-            self.add_repo(path, allow_dirty=allow_dirty)
+            self._set(('repositories', path), self._git_record(snapshot))
+        return errors
 
     def requirements(self):
         """Return a list of the installed packages.
@@ -470,6 +2471,7 @@ class Context:
                       DeprecationWarning)
         return self.add_pip_packages()
 
+    @profiling.instrumented
     def export_requirements(self, path, message=None):
         """Export the list of installed package as a requirements.txt file.
 
@@ -477,6 +2479,7 @@ class Context:
                         Note that no extension will be automatically included
         :param message: If not None, the message will be included after the
                         header and before the requirements.
+        :return:        the SHA256 hexadecimal string of the saved file.
         """
         if self.data['packages'] is None:
             self.add_pip_packages()
@@ -491,8 +2494,7 @@ class Context:
             message = '{}\n'.format(message)
 
         req_str = '{}\n{}{}\n'.format(header, message, req_str)
-        with open(path, 'w') as f:
-            f.write(req_str)
+        return _write_bytes(path, req_str.encode('utf-8'))
 
 
 
@@ -0,0 +1,154 @@
+"""Compact encoding of the state of random number generators.
+
+The states are encoded as JSON, YAML and msgpack-compatible dictionaries, with
+the bulk of the state as a base64 string: the state of the `random` module is
+a 2.5 KB blob rather than a tuple of 625 integers.
+
+Supported generators are `random.Random` instances, numpy `Generator`,
+`BitGenerator` and `RandomState` instances, and torch `Generator` instances.
+numpy and torch are only imported to restore states: their objects are
+recognized by their type and attributes.
+"""
+import sys
+import base64
+import random
+import struct
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def encode_random_state(state):
+    """Encode a state of `random.getstate()`."""
+    version, internal, gauss_next = state
+    raw = struct.pack('<{}I'.format(len(internal)), *internal)
+    return {'version': version, 'data': _b64encode(raw), 'gauss_next': gauss_next}
+
+def decode_random_state(state):
+    """Decode a state encoded by `encode_random_state`.
+
+    States recorded by versions of reproducible older than 0.5.0, as plain
+    `(version, internal, gauss_next)` sequences, are accepted too.
+    """
+    if not isinstance(state, dict):
+        version, internal, gauss_next = state
+        return version, tuple(internal), gauss_next
+    raw = base64.b64decode(state['data'])
+    return (state['version'], struct.unpack('<{}I'.format(len(raw) // 4), raw),
+            state['gauss_next'])
+
+
+def encode_numpy_state(obj):
+    """Encode a numpy bit generator state, as returned by `.state` or by
+    `RandomState.get_state(legacy=False)`: arrays become base64 blobs, and
+    integers that do not fit in 64 bits (e.g. PCG64) hexadecimal strings."""
+    if isinstance(obj, dict):
+        return {key: encode_numpy_state(value) for key, value in obj.items()}
+    if hasattr(obj, 'dtype'):  # numpy array or scalar
+        if obj.ndim == 0:
+            return encode_numpy_state(obj.item())
+        return {'__type__': 'ndarray', 'dtype': obj.dtype.str,
+                'shape': list(obj.shape), 'data': _b64encode(obj.tobytes())}
+    if (isinstance(obj, int) and not isinstance(obj, bool)
+        and not -2**63 <= obj < 2**63):
+        return {'__type__': 'int', 'value': hex(obj)}
+    return obj
+
+def decode_numpy_state(obj):
+    """Decode a state encoded by `encode_numpy_state`.
+
+    :raise ImportError:  if the state contains arrays and numpy cannot be
+                         imported.
+    """
+    if not isinstance(obj, dict):
+        return obj
+    if obj.get('__type__') == 'ndarray':
+        import numpy
+        array = numpy.frombuffer(base64.b64decode(obj['data']), dtype=obj['dtype'])
+        return array.reshape(obj['shape']).copy()
+    if obj.get('__type__') == 'int':
+        return int(obj['value'], 16)
+    return {key: decode_numpy_state(value) for key, value in obj.items()}
+
+
+def encode_torch_state(tensor):
+    """Encode a torch RNG state, a uint8 tensor."""
+    return _b64encode(bytes(tensor.tolist()))
+
+def decode_torch_state(state):
+    """Decode a state encoded by `encode_torch_state`.
+
+    :raise ImportError:  if torch cannot be imported.
+    """
+    import torch
+    return torch.tensor(list(base64.b64decode(state)), dtype=torch.uint8)
+
+
+def _is_numpy(obj):
+    return type(obj).__module__.split('.')[0] == 'numpy'
+
+def generator_state(generator):
+    """Return the encoded state of a random generator.
+
+    :raise TypeError:  if the type of the generator is not supported.
+    """
+    if isinstance(generator, random.Random):
+        return encode_random_state(generator.getstate())
+    if _is_numpy(generator):
+        if hasattr(generator, 'bit_generator'):  # Generator
+            return encode_numpy_state(generator.bit_generator.state)
+        if hasattr(generator, 'get_state'):  # RandomState
+            return encode_numpy_state(generator.get_state(legacy=False))
+        return encode_numpy_state(generator.state)  # BitGenerator
+    if hasattr(generator, 'get_state') and hasattr(generator, 'set_state'):
+        return encode_torch_state(generator.get_state())
+    raise TypeError('unsupported random generator: {!r}'.format(generator))
+
+def restore_generator_state(generator, state):
+    """Restore the state of a random generator, as encoded by
+    `generator_state`.
+
+    :raise TypeError:  if the type of the generator is not supported.
+    """
+    if isinstance(generator, random.Random):
+        generator.setstate(decode_random_state(state))
+    elif _is_numpy(generator):
+        if hasattr(generator, 'bit_generator'):
+            generator.bit_generator.state = decode_numpy_state(state)
+        elif hasattr(generator, 'set_state'):
+            generator.set_state(decode_numpy_state(state))
+        else:
+            generator.state = decode_numpy_state(state)
+    elif hasattr(generator, 'get_state') and hasattr(generator, 'set_state'):
+        generator.set_state(decode_torch_state(state))
+    else:
+        raise TypeError('unsupported random generator: {!r}'.format(generator))
+
+
+def global_states():
+    """Return the encoded states of the global generators: the `random`
+    module, and the numpy legacy and torch CPU generators if numpy or torch
+    were imported."""
+    states = {'state': encode_random_state(random.getstate())}
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        states['numpy'] = encode_numpy_state(numpy.random.get_state(legacy=False))
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        states['torch'] = encode_torch_state(torch.get_rng_state())
+    return states
+
+def restore_global_states(states):
+    """Restore the states returned by `global_states`.
+
+    :raise ImportError:  if numpy or torch states are present, but the
+                         corresponding module cannot be imported.
+    """
+    random.setstate(decode_random_state(states['state']))
+    if 'numpy' in states:
+        import numpy
+        numpy.random.set_state(decode_numpy_state(states['numpy']))
+    if 'torch' in states:
+        import torch
+        torch.set_rng_state(decode_torch_state(states['torch']))
@@ -57,8 +57,13 @@ setuptools.setup(
     # required dependencies
     install_requires=['gitpython', 'pyyaml', 'py-cpuinfo'],
 
+    # command-line interface
+    entry_points={'console_scripts': ['reproducible = reproducible.cli:main']},
+
     # you can install extras_require with
     # $ pip install -e .[test]
-    extras_require={'tests': ['pytest', 'pytest-cov'],
-                    'docs' : ['sphinx', 'sphinx-rtd-theme']},
+    extras_require={'tests'  : ['pytest', 'pytest-cov'],
+                    'docs'   : ['sphinx', 'sphinx-rtd-theme'],
+                    'msgpack': ['msgpack'],
+                    'zstd'   : ['msgpack', 'zstandard']},
 )
@@ -0,0 +1,50 @@
+import os
+import json
+import array
+import tempfile
+
+import pytest
+
+import reproducible
+
+
+def test_store_arrays():
+    numpy = pytest.importorskip('numpy')
+    with tempfile.TemporaryDirectory() as store:
+        context = reproducible.Context(store=store, array_threshold=100)
+        weights = numpy.random.RandomState(0).normal(size=(50, 20))
+        mask = numpy.asfortranarray(weights > 0)
+        context.add_data('weights', weights)
+        context.add_data('init', {'mask': mask, 'perm': array.array('q', range(100)),
+                                  'lr': 0.1})
+        context.add_data('again', weights.copy())
+
+        data = json.loads(context.json())['data']
+        assert data['weights'] == data['again']
+        assert data['weights']['shape'] == [50, 20]
+        assert data['init']['lr'] == 0.1
+        assert len(os.listdir(os.path.join(store, 'arrays'))) == 3
+        assert data['weights']['sha256'] == reproducible.Context.sha256(
+                                                      data['weights']['path'])
+        # the store can be shared: the permissions follow the umask.
+        umask = os.umask(0)
+        os.umask(umask)
+        assert os.stat(data['weights']['path']).st_mode & 0o777 == 0o666 & ~umask
+
+        loaded = context.load_array(data['weights'], check=True)
+        assert isinstance(loaded, numpy.memmap)
+        assert (loaded == weights).all()
+        assert (context.load_array(data['init']['mask'], mmap=False) == mask).all()
+        assert context.load_array(data['init']['perm']).tolist() == list(range(100))
+
+        # arrays are kept inline without store, or below the threshold.
+        small = numpy.arange(3)
+        assert context.add_data('small', small) is context.data['data']['small']
+        context = reproducible.Context()
+        assert context.add_data('weights', weights) is context.data['data']['weights']
+        with pytest.raises(ValueError):
+            context.load_array(data['init'])
+
+
+if __name__ == '__main__':
+    test_store_arrays()
@@ -0,0 +1,102 @@
+import os
+import sys
+import asyncio
+import threading
+import tempfile
+
+import pytest
+
+import reproducible
+from test_reproducible import _make_repo
+
+
+def test_async():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo_path = os.path.join(tmp_dir, 'repo')
+        os.mkdir(repo_path)
+        _make_repo(repo_path)
+        with open(os.path.join(repo_path, 'tracked.txt'), 'a') as fd:
+            fd.write('modified\n')
+        paths = []
+        for i in range(20):
+            paths.append(os.path.join(tmp_dir, 'file{}.txt'.format(i)))
+            with open(paths[-1], 'w') as fd:
+                fd.write('content {}\n'.format(i))
+
+        expected = reproducible.Context()
+        expected.add_files(paths[1:])
+        expected.add_file(paths[0], category='single')
+        expected.add_repo(repo_path, allow_dirty=True)
+
+        context = reproducible.Context(async_workers=4)
+        async def record():
+            await asyncio.gather(context.aadd_files(paths[1:]),
+                                 context.aadd_file(paths[0], category='single'),
+                                 context.aadd_repo(repo_path, allow_dirty=True))
+            with pytest.raises(reproducible.RepositoryDirty):
+                await context.aadd_repo(repo_path)
+            with pytest.raises(reproducible.RepositoryNotFound):
+                await context.agit_snapshot(tmp_dir)
+            return await context.aexport_json(os.path.join(tmp_dir, 'r.json'))
+
+        sha256 = asyncio.run(record())
+        assert sha256 == reproducible.Context.sha256(os.path.join(tmp_dir, 'r.json'))
+        for key in ('files', 'repositories'):
+            assert context.data[key] == expected.data[key]
+
+        # out-of-line diffs, streamed from the asyncio subprocess.
+        store = os.path.join(tmp_dir, 'store')
+        snapshot = asyncio.run(reproducible.Context.agit_snapshot(repo_path,
+                                                                  store=store))
+        assert snapshot == dict(reproducible.git_snapshot(repo_path, store=store),
+                                elapsed=snapshot['elapsed'])
+
+        snapshot = asyncio.run(reproducible.Context.agit_snapshot(repo_path,
+                                                          max_diff_size=10))
+        assert snapshot['diff']['truncated']
+        assert snapshot['diff']['numstat'][0]['path'] == 'tracked.txt'
+
+
+def test_async_export(monkeypatch):
+    """Slow serializers and the writes run outside of the event loop thread"""
+    threads = []
+    def in_thread(func):
+        def wrapper(*args, **kwargs):
+            threads.append((func.__name__, threading.current_thread()))
+            return func(*args, **kwargs)
+        return wrapper
+    for name in ('_dumps_json', '_dumps_yaml', '_write_bytes'):
+        monkeypatch.setattr(reproducible.reproducible, name,
+                            in_thread(getattr(reproducible.reproducible, name)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = reproducible.Context()
+        context.add_data('values', [1, 2])
+        async def export():
+            task = asyncio.ensure_future(context.aexport_json(
+                                             os.path.join(tmp_dir, 'r.json')))
+            await asyncio.sleep(0)
+            context.add_data('later', True)  # not in the exported record.
+            return (await task,
+                    await context.aexport_yaml(os.path.join(tmp_dir, 'r.yaml')),
+                    await context.aexport_msgpack(os.path.join(tmp_dir, 'r.xz')))
+
+        for sha256, name in zip(asyncio.run(export()), ('r.json', 'r.yaml', 'r.xz')):
+            path = os.path.join(tmp_dir, name)
+            assert sha256 == reproducible.Context.sha256(path)
+        loaded = reproducible.Context.load(os.path.join(tmp_dir, 'r.json'))
+        assert loaded['data'] == {'values': [1, 2]}
+        assert reproducible.Context.load(os.path.join(tmp_dir, 'r.xz')) == context.data
+
+        # without orjson, the JSON encoding is done in a worker thread too.
+        monkeypatch.setitem(sys.modules, 'orjson', None)
+        sha256 = asyncio.run(context.aexport_json(os.path.join(tmp_dir, 'r.json')))
+        assert sha256 == reproducible.Context.sha256(os.path.join(tmp_dir, 'r.json'))
+
+    assert {name for name, _ in threads} == {'_dumps_json', '_dumps_yaml',
+                                             '_write_bytes'}
+    assert threading.current_thread() not in {thread for _, thread in threads}
+
+
+if __name__ == '__main__':
+    test_async()
@@ -1,6 +1,8 @@
 """Test that the library is behaving correctly"""
 import os
+import sys
 import tempfile
+import subprocess
 
 import reproducible
 
@@ -34,6 +36,29 @@ def test_export():
         assert json_string == fd.read()
 
 
+def test_import_time():
+    """Test that importing reproducible is fast, and does not import the
+    dependencies that are only needed by some of the functions"""
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            'import reproducible\n'
+            'print(time.perf_counter() - t)\n'
+            'print(" ".join(sorted(sys.modules)))')
+    budget = 0.25  # seconds, including the import of the standard modules.
+    for _ in range(3):  # not failing on a single slow run.
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.dirname(
+                                                 os.path.abspath(__file__))))
+        duration, modules = output.decode().split('\n')[:2]
+        modules = modules.split()
+        for heavy in ('git', 'cpuinfo', 'yaml', 'inspect'):
+            assert heavy not in modules
+        if float(duration) < budget:
+            break
+    assert float(duration) < budget
+
+
 if __name__ == "__main__":
     test_function_args()
     test_export()
+    test_import_time()
@@ -0,0 +1,60 @@
+import os
+import copy
+import json
+import time
+
+import reproducible
+
+
+here = os.path.dirname(__file__)
+
+
+def test_compare():
+    context = reproducible.Context(cpuinfo=True, pip_packages=True)
+    assert isinstance(reproducible.compare(context), reproducible.RecordDiff)
+    context.add_random_state()
+    context.add_data('seed', 1)
+    context.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert not context.compare(context)
+    # an exported and reloaded record is equal to the original.
+    assert not context.compare(json.loads(context.json()))
+
+    other = copy.deepcopy(context.data)
+    other['timestamp'] = 'later'
+    other['packages'] = [p for p in other['packages']
+                         if not p.startswith('PyYAML==')] + ['newpkg==1.0']
+    other['packages'] = ['GitPython==0.0.1' if p.startswith('GitPython==') else p
+                         for p in other['packages']]
+    other['cpuinfo']['flags'] = other['cpuinfo']['flags'][1:] + ['newflag']
+    other['files']['input'][os.path.join(here, 'poem.txt')]['sha256'] = '0' * 64
+    other['data']['seed'] = 2
+    other['random']['state'] = reproducible.rng.encode_random_state(
+                                                          (3, (0,) * 625, None))
+
+    diff = context.compare(other)
+    packages = {change.key: change for change in diff.section('packages')}
+    assert packages['pyyaml'].kind == 'removed'
+    assert packages['newpkg'].kind == 'added'
+    assert packages['gitpython'].new == '0.0.1'
+    assert {change.kind for change in diff.section('cpuinfo')} == {'added', 'removed'}
+    change, = diff.section('files')
+    assert change.key == ('input', os.path.join(here, 'poem.txt'))
+    assert diff.section('data') == [reproducible.Change('data', 'seed',
+                                                        'changed', 1, 2)]
+    change, = [c for c in diff.section('random') if c.key == 'state']
+    assert change.new.startswith('sha256:')
+    assert diff.section('timestamp') == []
+    assert 'packages: 1 changed, 1 added, 1 removed' in diff.summary()
+
+
+def test_compare_large():
+    """Comparing records with many files is fast"""
+    files = {'output': {'out/{}.bin'.format(i): {'sha256': str(i), 'mtime': i}
+                        for i in range(50000)}}
+    a = {'files': files}
+    b = copy.deepcopy(a)
+    b['files']['output']['out/10.bin']['sha256'] = 'modified'
+    start = time.perf_counter()
+    diff = reproducible.comparison.compare(a, b)
+    assert time.perf_counter() - start < 2.0
+    assert len(diff) == 1
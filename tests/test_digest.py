@@ -0,0 +1,84 @@
+import sys
+import json
+import time
+
+import pytest
+
+import reproducible
+from reproducible.reproducible import _canonical_chunks, _canonical_encoder
+
+
+def test_digest(monkeypatch):
+    context = reproducible.Context(pip_packages=True)
+    context.add_random_state()
+    context.add_data('params', {'lr': 0.1, 'layers': (3, 4), 'name': 'é'})
+    context.add_data('table', {i: [i, str(i)] for i in range(200)})
+    context.add_data('rows', [{'b': i, 'a': [i] * 100} for i in range(100)])
+
+    data = context.data
+    assert ''.join(_canonical_chunks(data)) == _canonical_encoder.encode(data)
+
+    # the digest does not depend on the export format.
+    digest = context.digest()
+    assert len(digest) == 64
+    loaded = reproducible.Context()
+    loaded.data = json.loads(context.json())
+    loaded.data['data']['table'] = {int(k): v for k, v in
+                                    loaded.data['data']['table'].items()}
+    assert loaded.digest() == digest
+
+    other = reproducible.Context(pip_packages=True)
+    assert other.digest() != context.digest()
+    assert (other.digest(ignore=('timestamp',)) ==
+            reproducible.Context(pip_packages=True).digest(ignore=('timestamp',)))
+
+    # the stdlib and orjson encodings are equivalent.
+    fast = context.json()
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    assert json.loads(context.json()) == json.loads(fast)
+
+
+def test_json_backends(monkeypatch):
+    """The JSON export does not depend on orjson being installed"""
+    import datetime
+    context = reproducible.Context()
+    context.add_data('values', [float('nan'), float('inf'), 1.5])
+    exports = [context.json()]
+    context.add_data('big', 2**70)
+    exports.append(context.json())
+    context.add_data('date', datetime.date(2020, 1, 1))
+    with pytest.raises(TypeError):
+        context.json()
+    del context.data['data']['date']
+
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    assert context.json() == exports[1]
+    del context.data['data']['big']
+    assert context.json() == exports[0]
+    assert '"values": [\n      NaN,\n      Infinity,' in exports[0]
+
+    # the same bytes are written by both backends.
+    monkeypatch.undo()
+    records = [{'path': 'données/é.txt', 'argv': ['-n', '日本', '\x00\x1f"\\'],
+                'values': [0.0, -0.0, 1e-4, 0.1, 1.5, 9007199254740993.0, 2**63 - 1]},
+               {'values': [1e16, 1e-7, 5e-324, -1.2e300]},
+               {'values': ({1: 'a'}, (1, 2), [])}]
+    outputs = [reproducible.reproducible._dumps_json(r) for r in records]
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    assert [reproducible.reproducible._dumps_json(r) for r in records] == outputs
+    assert '"données/é.txt"' in outputs[0] and '1e+16' in outputs[1]
+
+
+def test_digest_large():
+    """Digesting a large record is fast"""
+    files = {'out/{}.bin'.format(i): {'sha256': str(i) * 64, 'mtime': i}
+             for i in range(50000)}
+    context = reproducible.Context()
+    context.data['files'] = {'output': files}
+    start = time.perf_counter()
+    context.digest()
+    assert time.perf_counter() - start < 2.0
+
+
+if __name__ == '__main__':
+    test_digest_large()
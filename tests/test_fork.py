@@ -0,0 +1,55 @@
+import os
+import pickle
+import random
+import tempfile
+
+import pytest
+
+import reproducible
+
+
+def _work(child, path, i):
+    with open(path, 'w') as fd:
+        fd.write('output {}\n'.format(i))
+    random.seed(i)
+    child.add_random_state()
+    child.add_file(path, category='output')
+    child.add_data('param_{}'.format(i), i)
+    child.add_data('shared', 'same')
+    return child
+
+
+def test_fork_merge():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = reproducible.Context(pip_packages=True)
+        children = []
+        for i in range(4):
+            child = context.fork()
+            payload = pickle.dumps(child)
+            assert len(payload) < len(pickle.dumps(context.data)) / 2
+            path = os.path.join(tmp_dir, 'out{}.txt'.format(i))
+            child = pickle.loads(pickle.dumps(_work(pickle.loads(payload), path, i)))
+            children.append(child)
+        assert [child.fork_name for child in children] == ['0', '1', '2', '3']
+        assert children[0].fork().fork_name == '0.0'
+
+        packages = context.data['packages']
+        context.merge(reversed(children))
+        data = context.data
+        assert data['packages'] == packages
+        assert len(data['files']['output']) == 4
+        assert data['data']['param_3'] == 3 and data['data']['shared'] == 'same'
+        assert data['forks']['2']['random']['state'] != data['forks']['1']['random']['state']
+
+        # merging is all-or-nothing.
+        conflicting = context.fork()
+        conflicting.add_data('shared', 'different')
+        conflicting.add_data('other', 1)
+        with pytest.raises(reproducible.MergeConflict) as excinfo:
+            context.merge([conflicting])
+        assert excinfo.value.conflicts == [(('data', 'shared'), 'same', 'different')]
+        assert 'other' not in context.data['data']
+
+
+if __name__ == '__main__':
+    test_fork_merge()
@@ -0,0 +1,62 @@
+import os
+import json
+import tempfile
+
+import reproducible
+from reproducible.cli import main
+
+from test_reproducible import _make_repo
+
+
+here = os.path.dirname(__file__)
+
+
+def test_index(capsys):
+    poem_path = os.path.join(here, 'poem.txt')
+    poem_sha256 = reproducible.Context.sha256(poem_path)
+    with tempfile.TemporaryDirectory() as repo_path, \
+         tempfile.TemporaryDirectory() as records_dir:
+        _make_repo(repo_path)
+        commit = reproducible.git_snapshot(repo_path)['hash']
+
+        for i, export in enumerate(('export_json', 'export_yaml',
+                                    'export_msgpack')):
+            context = reproducible.Context(pip_packages=True)
+            context.add_data('run', i)
+            context.add_repo(repo_path, allow_dirty=True)
+            if i > 0:
+                context.add_file(poem_path, 'input')
+            getattr(context, export)(os.path.join(records_dir,
+                                                  'run{}.{}'.format(i, export[7:])))
+        with open(os.path.join(records_dir, 'other.json'), 'w') as fd:
+            json.dump({'unrelated': True}, fd)
+        # malformed or partially written files are skipped.
+        broken = {'broken.json': b'{"python": {', 'broken.yaml': b'a: [b\n',
+                  'broken.xz': b'\xfd7zXZ\x00 truncated'}
+        for name, content in broken.items():
+            with open(os.path.join(records_dir, name), 'wb') as fd:
+                fd.write(content)
+
+        db_path = os.path.join(records_dir, 'index.sqlite')
+        with reproducible.Index(db_path) as index:
+            assert index.ingest(records_dir) == 3
+            assert sorted(os.path.basename(path)
+                          for path, _ in index.skipped) == sorted(broken)
+            assert index.ingest(records_dir) == 0
+
+            assert len(index.records_with_file(poem_sha256)) == 2
+            assert len(index.records_with_file(poem_sha256, category='output')) == 0
+            assert len(index.records_with_commit(commit)) == 3
+            assert len(index.records_with_commit(commit[:8], dirty=True)) == 0
+            assert len(index.records_with_package('gitpython')) == 3
+            run, = index.records_with_data('run', 1)
+            assert run['path'].endswith('run1.yaml')
+
+        main(['index', db_path, records_dir])
+        err = capsys.readouterr().err
+        assert err.count('skipped') == 3 and 'broken.json' in err
+
+        main(['query', db_path, '--file', poem_sha256])
+        output = capsys.readouterr().out.split()
+        assert sorted(os.path.basename(p) for p in output) == ['run1.yaml',
+                                                              'run2.msgpack']
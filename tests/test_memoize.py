@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import subprocess
+
+import reproducible
+
+
+def test_memoize():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = reproducible.Context()
+        cache = reproducible.ResultCache(os.path.join(tmp_dir, 'results'))
+        input_path = os.path.join(tmp_dir, 'input.txt')
+        with open(input_path, 'w') as fd:
+            fd.write('1 2 3\n')
+        calls = []
+
+        @context.memoize(cache=cache)
+        def total(path, factor=1):
+            calls.append(path)
+            with open(path) as f:
+                return sum(int(x) for x in f.read().split()) * factor
+
+        assert total(input_path) == 6
+        assert total(input_path, factor=1) == 6
+        assert total(input_path, 2) == 12
+        assert len(calls) == 2
+        name = '{}.{}'.format(total.__module__, total.__qualname__)
+        assert context.data['memoize'][name] == {'hits': 1, 'misses': 2}
+
+        # a modified input file is a cache miss.
+        with open(input_path, 'w') as fd:
+            fd.write('1 2 3 4\n')
+        assert total(input_path) == 10
+        assert len(calls) == 3
+
+        # so is a modified function, even with the same name.
+        @context.memoize(cache=cache)
+        def total(path, factor=1):
+            return -1
+        assert total(input_path) == -1
+
+        # least recently used results are evicted.
+        small = reproducible.ResultCache(os.path.join(tmp_dir, 'small'),
+                                         max_size=2500)
+        @context.memoize(cache=small)
+        def payload(i):
+            return bytes(1000)
+        for i in range(3):
+            payload(i)
+        assert len(small) == 2
+        payload(2)
+        assert context.data['memoize'][name.replace('total', 'payload')]['hits'] == 1
+
+
+def test_memoize_types():
+    """Arguments that are equal in JSON, but not in Python, are different keys"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = reproducible.Context()
+        cache = reproducible.ResultCache(os.path.join(tmp_dir, 'results'))
+
+        @context.memoize(cache=cache)
+        def kind(x):
+            return type(x).__name__, repr(x)
+
+        values = [(1, 2), [1, 2], {1: 'a'}, {'1': 'a'}, {'__type__': 'tuple'},
+                  {1, 2}, frozenset([1, 2]), 1, 1.0, True, '1']
+        for value in values:
+            assert kind(value) == (type(value).__name__, repr(value))
+        assert kind({2: 'b', 1: 'a'}) == kind({1: 'a', 2: 'b'})
+        name = '{}.{}'.format(kind.__module__, kind.__qualname__)
+        assert context.data['memoize'][name] == {'hits': 1,
+                                                 'misses': len(values) + 1}
+
+
+_DIGEST_SCRIPT = """
+from reproducible.reproducible import _code_digest
+def f(x):
+    return x in {'alpha', 'beta', 'gamma', 'delta', ('a', 1)}
+print(_code_digest(f.__code__))
+"""
+
+def test_code_digest_hash_seed():
+    """The code digest does not depend on the hash seed of the process"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digests = set()
+    for seed in ('1', '2', '3'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        digests.add(subprocess.check_output([sys.executable, '-c', _DIGEST_SCRIPT],
+                                            cwd=root, env=env))
+    assert len(digests) == 1
+
+
+if __name__ == '__main__':
+    test_memoize()
@@ -0,0 +1,88 @@
+import os
+import pickle
+import tempfile
+
+import reproducible
+
+from test_reproducible import _make_repo
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_profile():
+    path = os.path.join(here, 'poem.txt')
+    with tempfile.TemporaryDirectory() as repo_path:
+        _make_repo(repo_path)
+        context = reproducible.Context(profile=True)
+        context.add_file(path, 'input')
+        context.add_repo(repo_path)
+        context.export_json(os.path.join(repo_path, 'record.json'))
+
+    profile = context.data['_profile']
+    assert profile['_collect_basic_data']['calls'] == 1
+    assert profile['sha256']['bytes_read'] == os.path.getsize(path)
+    assert profile['add_file']['bytes_read'] == os.path.getsize(path)
+    assert profile['git_snapshot']['subprocesses'] >= 1
+    assert profile['add_repo']['subprocesses'] >= 1
+    assert profile['export_json']['calls'] == 1
+    for measures in profile.values():
+        assert measures['wall'] >= 0 and measures['cpu'] >= 0
+
+    # class methods are not profiled outside of a profiled context.
+    reproducible.Context.sha256(path)
+    assert context.data['_profile']['sha256']['calls'] == 1
+
+    context.add_files([path, path], 'input', already=True)
+    assert context.data['_profile']['sha256']['calls'] >= 2
+
+def test_profile_record_identity():
+    """The timings do not change the identity of a record"""
+    path = os.path.join(here, 'poem.txt')
+    contexts = []
+    for _ in range(2):
+        contexts.append(reproducible.Context(profile=True))
+        contexts[-1].add_file(path, 'input')
+    a, b = contexts
+    assert a.data['_profile'] != b.data['_profile']
+    assert a.digest(ignore=('timestamp',)) == b.digest(ignore=('timestamp',))
+    assert not a.compare(b)
+    assert '_profile' in a.compare(b, ignore=()).sections
+
+def test_profile_disabled(monkeypatch):
+    monkeypatch.delenv('REPRODUCIBLE_PROFILE', raising=False)
+    context = reproducible.Context()
+    context.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert '_profile' not in context.data
+
+    monkeypatch.setenv('REPRODUCIBLE_PROFILE', '1')
+    context = reproducible.Context()
+    context.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert context.data['_profile']['add_file']['calls'] == 1
+    assert '_profile' not in reproducible.Context(profile=False).data
+
+def test_profile_hooks():
+    calls = []
+    def hook(name, measures):
+        calls.append((name, measures))
+
+    context = reproducible.Context()
+    context.add_profile_hook(hook)
+    context.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert [name for name, _ in calls] == ['sha256', 'add_file']
+    assert set(calls[0][1]) == {'wall', 'cpu', 'bytes_read', 'subprocesses'}
+
+    # hooks are not pickled, but are inherited by forks.
+    child = pickle.loads(pickle.dumps(context))
+    assert child._profile.hooks == []
+    child = context.fork()
+    child.add_data('x', 1)
+    child.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert calls[-1][0] == 'add_file'
+    context.merge([child])
+    assert context.data['forks']['0']['_profile']['add_file']['calls'] == 1
+
+    context.remove_profile_hook(hook)
+    del calls[:]
+    context.add_file(os.path.join(here, 'poem.txt'), 'input')
+    assert calls == []
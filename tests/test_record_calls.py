@@ -0,0 +1,77 @@
+import json
+import time
+
+import reproducible
+
+
+def test_record_calls():
+    context = reproducible.Context()
+
+    @context.record_calls(maxlen=5)
+    def step(i, lr=0.1, *rest, **options):
+        return i
+
+    @context.record_calls(every=10)
+    def sampled(i, lr=0.1):
+        return i
+
+    @context.record_calls(max_rate=5)
+    def limited(i):
+        return i
+
+    @context.record_calls(max_rate=0.5)
+    def slow(i):
+        return i
+
+    for i in range(100):
+        assert step(i, momentum=0.9) == i
+        sampled(i, lr=0.2)
+        limited(i)
+        slow(i)
+    step(100, 0.5, 'extra')
+
+    def name(func):
+        return '{}.{}'.format(func.__module__, func.__qualname__)
+    calls = json.loads(context.json())['calls']
+    record = calls[name(step)]
+    assert record['calls'] == record['recorded'] == 101
+    assert [e['call'] for e in record['entries']] == [97, 98, 99, 100, 101]
+    assert record['entries'][0]['args'] == {'i': 96, 'lr': 0.1, 'rest': [],
+                                            'options': {'momentum': 0.9}}
+    assert record['entries'][-1]['args'] == {'i': 100, 'lr': 0.5,
+                                             'rest': ['extra'], 'options': {}}
+
+    record = calls[name(sampled)]
+    assert record['recorded'] == 10
+    assert record['entries'][1] == dict(record['entries'][1], call=11,
+                                        args={'i': 10, 'lr': 0.2})
+    assert calls[name(limited)]['recorded'] == 5
+
+    # rates below one call per second record one call every 1 / max_rate s.
+    assert calls[name(slow)]['recorded'] == 1
+    recorder, = [r for r in context._recorders if r.name == name(slow)]
+    recorder._last -= 2.0
+    slow(100)
+    slow(101)
+    assert context.data['calls'][name(slow)]['recorded'] == 2
+
+    context.reset()
+    assert 'calls' not in context.data
+    step(0)
+    assert context.data['calls'][name(step)]['calls'] == 1
+
+
+def test_record_calls_overhead():
+    context = reproducible.Context()
+    @context.record_calls(maxlen=100)
+    def f(a, b=1):
+        return a
+    start = time.perf_counter()
+    for i in range(100000):
+        f(i)
+    assert time.perf_counter() - start < 2.0
+
+
+if __name__ == '__main__':
+    test_record_calls()
+    test_record_calls_overhead()
@@ -1,4 +1,12 @@
 import os
+import json
+import time
+import hashlib
+import tempfile
+import subprocess
+
+import pytest
+
 import reproducible
 
 # from test_repeatable import _scrub_cpu_info
@@ -6,6 +14,18 @@ import reproducible
 
 here = os.path.dirname(__file__)
 
+def _make_repo(path):
+    """Create a git repository with one commit"""
+    def git(*args):
+        subprocess.check_output(('git', '-c', 'user.name=test',
+                                 '-c', 'user.email=test@example.com') + args,
+                                cwd=path)
+    git('init', '-q')
+    with open(os.path.join(path, 'tracked.txt'), 'w') as fd:
+        fd.write('tracked\n')
+    git('add', 'tracked.txt')
+    git('commit', '-q', '-m', 'first commit')
+
 def test_sha256():
     context = reproducible.Context(cpuinfo=False)
     path = os.path.join(here, 'poem.txt')
@@ -16,6 +36,360 @@ def test_sha256():
     sha256 = 'bf41d9903d19d62bdae1de79e904d361fcfa6968b7cb69c7e454d5e96200b85d'
     assert context.data['files']['input'][path]['sha256'] == sha256
 
+def test_hash_cache():
+    sha256 = 'bf41d9903d19d62bdae1de79e904d361fcfa6968b7cb69c7e454d5e96200b85d'
+    path = os.path.join(here, 'poem.txt')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = reproducible.HashCache(os.path.join(tmp_dir, 'hashes.sqlite'))
+        context = reproducible.Context(hash_cache=cache)
+        assert context.add_file(path, 'input') == sha256
+        assert len(cache) == 1
+
+        # a cache hit does not read the file.
+        cache.set(os.stat(path), 'cached')
+        assert context.add_file(path, 'input') == 'cached'
+        assert context.add_file(path, 'input', strict=True) == sha256
+
+        # eviction
+        cache = reproducible.HashCache(os.path.join(tmp_dir, 'small.sqlite'),
+                                       max_entries=2)
+        for i in range(5):
+            filepath = os.path.join(tmp_dir, '{}.txt'.format(i))
+            with open(filepath, 'w') as fd:
+                fd.write(str(i))
+            reproducible.Context.sha256(filepath, cache=cache)
+        assert len(cache) == 2
+        cache.close()
+
+def test_add_files():
+    context = reproducible.Context(cpuinfo=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(20):
+            paths.append(os.path.join(tmp_dir, '{}.bin'.format(i)))
+            with open(paths[-1], 'wb') as fd:
+                fd.write(os.urandom(i * 100000))
+        sha256s = context.add_files(paths, 'output', workers=4)
+        for path in paths:
+            with open(path, 'rb') as fd:
+                assert sha256s[path] == hashlib.sha256(fd.read()).hexdigest()
+            assert context.data['files']['output'][path]['sha256'] == sha256s[path]
+
+def test_add_directory(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = os.path.join(tmp_dir, 'tree')
+        for subdir in ('a', 'a/b', 'c'):
+            os.makedirs(os.path.join(root, subdir))
+        for filename in ('x.txt', 'a/y.txt', 'a/b/z.txt', 'c/w.log'):
+            with open(os.path.join(root, filename), 'w') as fd:
+                fd.write(filename)
+        manifest = os.path.join(tmp_dir, 'manifest.json')
+
+        context = reproducible.Context(cpuinfo=False)
+        root_1 = context.add_directory(root, 'input', manifest=manifest)
+        assert context.data['directories']['input'][root]['files'] == 4
+        assert context.add_directory(root, 'input') == root_1
+        root_txt = context.add_directory(root, 'txt', include=['*.txt'])
+        assert root_txt != root_1
+        assert context.add_directory(root, 'txt', exclude=['c']) == root_txt
+
+        # only the modified file is hashed again.
+        hashed = []
+        sha256 = reproducible.Context.sha256
+        def counting_sha256(cls, path, cache=None):
+            hashed.append(path)
+            return sha256(path, cache=cache)
+        monkeypatch.setattr(reproducible.Context, 'sha256',
+                            classmethod(counting_sha256))
+        with open(os.path.join(root, 'a/b/z.txt'), 'w') as fd:
+            fd.write('modified')
+        root_2 = context.add_directory(root, 'input', manifest=manifest)
+        assert hashed == [os.path.join(root, 'a/b/z.txt')]
+        assert root_2 != root_1
+        assert context.add_directory(root, 'input', strict=True) == root_2
+
+def test_cpu_info_cache(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monkeypatch.setenv('REPRODUCIBLE_CACHE_DIR', tmp_dir)
+        monkeypatch.setattr(reproducible.cache, '_cpu_info', None)
+        context = reproducible.Context(cpuinfo=True)
+        assert 'hz_actual' not in context.data['cpuinfo']
+        if reproducible.cache._machine_key() is None:  # not on Linux
+            return
+        cache_files = os.listdir(tmp_dir)
+        assert len(cache_files) == 1
+
+        # another process would read the cache file.
+        monkeypatch.setattr(reproducible.cache, '_cpu_info', None)
+        key = reproducible.cache._machine_key()
+        reproducible.cache.write_cache_file(cache_files[0], key,
+                                            {'brand_raw': 'cached'})
+        assert context.add_cpu_info() == {'brand_raw': 'cached'}
+        assert context.add_cpu_info(cache=False) != {'brand_raw': 'cached'}
+
+def test_pip_packages(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        monkeypatch.setenv('REPRODUCIBLE_CACHE_DIR', tmp_dir)
+        monkeypatch.setattr(reproducible.reproducible, '_packages', {})
+        context = reproducible.Context(cpuinfo=False)
+        packages = context.add_pip_packages()
+        assert any(p.startswith('GitPython==') for p in packages)
+        assert not any(p.startswith('pip==') for p in packages)
+        assert context.add_pip_packages(cache=False) == packages
+
+        # another process, in the same environment, would read the cache file.
+        filename, = os.listdir(tmp_dir)
+        key = reproducible.reproducible._packages_key(
+                                      reproducible.reproducible._package_dirs())
+        reproducible.cache.write_cache_file(filename, key, ['cached==1.0'])
+        monkeypatch.setattr(reproducible.reproducible, '_packages', {})
+        assert context.add_pip_packages() == ['cached==1.0']
+
+def test_background():
+    with tempfile.TemporaryDirectory() as repo_path:
+        _make_repo(repo_path)
+        context = reproducible.Context(cpuinfo=True, pip_packages=True,
+                                       background=True)
+        context.add_repo(repo_path, allow_dirty=True)
+        assert len(context._pending) == 3
+
+        expected = reproducible.Context(cpuinfo=True, pip_packages=True)
+        expected.add_repo(repo_path, allow_dirty=True)
+        data = context.data
+        assert not context._pending
+        for key in ('cpuinfo', 'packages', 'repositories'):
+            assert data[key] == expected.data[key]
+
+        # errors of background collectors are raised when the data is read.
+        context.reset()
+        context.add_repo(os.path.join(repo_path, 'missing'), allow_dirty=True)
+        with pytest.raises(FileNotFoundError):
+            context.data
+        assert 'packages' in context.data
+
+def test_background_journal(monkeypatch):
+    """Opening a journal does not wait for the background collectors"""
+    def slow_cpu_info(cache=True):
+        time.sleep(1.0)
+        return {'brand': 'slow'}
+    monkeypatch.setattr(reproducible.reproducible, 'cpu_info', slow_cpu_info)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'run.journal')
+        start = time.perf_counter()
+        context = reproducible.Context(cpuinfo=True, background=True,
+                                       journal=path)
+        assert time.perf_counter() - start < 0.5
+        assert 'cpuinfo' not in context._data
+        assert context.data['cpuinfo'] == {'brand': 'slow'}
+        context.close_journal()
+        assert reproducible.Context.load_journal(path)['cpuinfo'] == {'brand': 'slow'}
+
+def test_git_snapshot():
+    with tempfile.TemporaryDirectory() as repo_path:
+        _make_repo(repo_path)
+        snapshot = reproducible.git_snapshot(repo_path)
+        assert len(snapshot['hash']) == 40
+        assert not snapshot['dirty'] and not snapshot['untracked']
+        assert snapshot['diff'] is None and snapshot['elapsed'] > 0
+
+        with open(os.path.join(repo_path, 'untracked.txt'), 'w') as fd:
+            fd.write('untracked\n')
+        snapshot = reproducible.git_snapshot(repo_path)
+        assert not snapshot['dirty'] and snapshot['untracked']
+        assert reproducible.git_dirty(repo_path)
+        assert not reproducible.git_dirty(repo_path, allow_untracked=True)
+
+        context = reproducible.Context(cpuinfo=False)
+        context.add_repo(repo_path, allow_untracked=True)
+        with open(os.path.join(repo_path, 'tracked.txt'), 'a') as fd:
+            fd.write('modified\n')
+        with pytest.raises(reproducible.RepositoryDirty):
+            context.add_repo(repo_path, allow_untracked=True)
+        context.add_repo(repo_path, allow_dirty=True)
+        info = context.data['repositories'][repo_path]
+        assert info['dirty'] and '+modified' in info['diff']
+        assert info == reproducible.git_info(repo_path)
+
+def test_git_diff_store():
+    import gzip
+    with tempfile.TemporaryDirectory() as repo_path, \
+         tempfile.TemporaryDirectory() as store:
+        _make_repo(repo_path)
+        with open(os.path.join(repo_path, 'tracked.txt'), 'a') as fd:
+            fd.write('modified\n')
+
+        context = reproducible.Context(cpuinfo=False, store=store)
+        context.add_repo(repo_path, allow_dirty=True)
+        diff = context.data['repositories'][repo_path]['diff']
+        with gzip.open(diff['path'], 'rb') as fd:
+            patch = fd.read()
+        assert diff['sha256'] == hashlib.sha256(patch).hexdigest()
+        assert diff['size'] == len(patch)
+        assert patch.decode()[:-1] == reproducible.git_info(repo_path)['diff']
+        umask = os.umask(0)
+        os.umask(umask)
+        assert os.stat(diff['path']).st_mode & 0o777 == 0o666 & ~umask
+
+        context = reproducible.Context(cpuinfo=False, store=store,
+                                       max_diff_size=10)
+        context.add_repo(repo_path, allow_dirty=True)
+        diff = context.data['repositories'][repo_path]['diff']
+        assert diff['truncated']
+        assert diff['numstat'] == [{'path': 'tracked.txt', 'added': 1,
+                                    'deleted': 0}]
+        # no leftover from the truncated diff.
+        assert os.listdir(os.path.join(store, 'diffs')) == [
+                      '{}.patch.gz'.format(hashlib.sha256(patch).hexdigest())]
+
+def test_journal():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        journal_path = os.path.join(tmp_dir, 'journal.jsonl')
+        context = reproducible.Context(cpuinfo=False, journal=journal_path)
+        context.add_random_state()
+        for i in range(10):
+            context.add_data(str(i), {'i': i})
+        context.add_file(os.path.join(here, 'poem.txt'), 'input')
+        context.add_files([os.path.join(here, 'poem.txt')], 'output')
+        context.untrack_file(os.path.join(here, 'poem.txt'), 'input')
+        context.close_journal()
+        expected = json.loads(context.json())
+        assert reproducible.Context.load_journal(journal_path) == expected
+
+        # a crash while writing the last change.
+        with open(journal_path, 'a') as fd:
+            fd.write('{"op": "set", "keys": ["da')
+        assert reproducible.Context.load_journal(journal_path) == expected
+
+        json_path = os.path.join(tmp_dir, 'data.json')
+        assert reproducible.Context.compact_journal(journal_path,
+                                                    output=json_path) == expected
+        with open(journal_path) as fd:
+            assert len(fd.readlines()) == 1
+        with open(json_path) as fd:
+            assert json.load(fd) == expected
+
+def test_verify():
+    from reproducible.cli import main
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, '{}.txt'.format(i)) for i in range(4)]
+        for path in paths:
+            with open(path, 'w') as fd:
+                fd.write(path)
+        context = reproducible.Context(cpuinfo=False)
+        context.add_files(paths, 'output')
+        record_path = os.path.join(tmp_dir, 'record.json')
+        context.export_json(record_path)
+
+        report = context.verify()
+        assert report.ok and report.bytes_read == 0
+        assert len(context.verify(strict=True).unchanged) == 4
+        assert main(['verify', record_path]) == 0
+
+        with open(paths[0], 'a') as fd:
+            fd.write('modified')
+        os.remove(paths[1])
+        os.utime(paths[2], (0, 0))  # same content, different mtime
+        report = context.verify(record_path, workers=2)
+        assert not report.ok
+        assert report.modified == [('output', paths[0])]
+        assert report.missing == [('output', paths[1])]
+        assert report.unchanged == [('output', paths[2]), ('output', paths[3])]
+        assert report.bytes_read == os.path.getsize(paths[0]) + len(paths[2])
+        assert main(['verify', record_path, '--strict']) == 1
+
+def _fake_dist(site_dir, name, direct_url=None):
+    """Create the metadata of a distribution installed in `site_dir`"""
+    dist_info = os.path.join(site_dir, '{}-1.0.dist-info'.format(name))
+    os.makedirs(dist_info)
+    with open(os.path.join(dist_info, 'METADATA'), 'w') as fd:
+        fd.write('Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n'.format(name))
+    if direct_url is not None:
+        with open(os.path.join(dist_info, 'direct_url.json'), 'w') as fd:
+            if isinstance(direct_url, str):  # e.g. invalid metadata.
+                fd.write(direct_url)
+            else:
+                json.dump(direct_url, fd)
+
+def test_editable_repos(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        site_dir, paths = os.path.join(tmp_dir, 'site'), {}
+        for name in ('clean', 'dirty', 'norepo'):
+            paths[name] = os.path.join(tmp_dir, name)
+            os.makedirs(paths[name])
+            if name != 'norepo':
+                _make_repo(paths[name])
+            _fake_dist(site_dir, name, {'url': 'file://' + paths[name],
+                                        'dir_info': {'editable': True}})
+        with open(os.path.join(paths['dirty'], 'tracked.txt'), 'a') as fd:
+            fd.write('modified\n')
+        _fake_dist(site_dir, 'regular')
+        _fake_dist(site_dir, 'direct', {'url': 'file://' + paths['clean'],
+                                        'dir_info': {}})
+        _fake_dist(site_dir, 'remote', {'url': 'https://example.com/remote.git',
+                                        'vcs_info': {'vcs': 'git', 'commit_id': '0'},
+                                        'dir_info': {'editable': True}})
+        monkeypatch.syspath_prepend(site_dir)
+
+        context = reproducible.Context()
+        editables = [e for e in context.find_editable_repos()
+                     if e[2].startswith(tmp_dir)]
+        assert editables == [(name, '1.0', paths[name])
+                             for name in ('clean', 'dirty', 'norepo')]
+
+        errors = context.add_editable_repos(workers=3)
+        assert {p for p in errors if p.startswith(tmp_dir)} == {paths['norepo']}
+        assert isinstance(errors[paths['norepo']], reproducible.RepositoryNotFound)
+        repos = context.data['repositories']
+        assert not repos[paths['clean']]['dirty']
+        assert 'modified' in repos[paths['dirty']]['diff']
+
+        context = reproducible.Context()
+        errors = context.add_editable_repos(allow_dirty=False)
+        assert isinstance(errors[paths['dirty']], reproducible.RepositoryDirty)
+        assert paths['clean'] in context.data['repositories']
+        assert paths['dirty'] not in context.data['repositories']
+
+def test_invalid_direct_url(monkeypatch):
+    """Invalid PEP 610 metadata is ignored, as pip does"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _fake_dist(tmp_dir, 'broken', '{"url": ')
+        _fake_dist(tmp_dir, 'nourl', {'dir_info': {'editable': True}})
+        _fake_dist(tmp_dir, 'badvcs', {'url': 'https://example.com/repo.git',
+                                       'vcs_info': {'vcs': 'git'}})
+        _fake_dist(tmp_dir, 'direct', {'url': 'https://example.com/d.whl',
+                                       'archive_info': {}})
+        monkeypatch.syspath_prepend(tmp_dir)
+        packages = reproducible.Context().add_pip_packages(cache=False)
+        for name in ('broken', 'nourl', 'badvcs'):
+            assert '{}==1.0'.format(name) in packages
+        assert 'direct @ https://example.com/d.whl' in packages
+        assert not any(path.startswith(tmp_dir) for _, _, path
+                       in reproducible.Context().find_editable_repos())
+
+def test_atomic_export():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = reproducible.Context(pip_packages=True)
+        for export, name in ((context.export_json, 'r.json'),
+                             (context.export_yaml, 'r.yaml'),
+                             (context.export_requirements, 'reqs.txt')):
+            path = os.path.join(tmp_dir, name)
+            assert export(path) == reproducible.Context.sha256(path)
+        mode = os.stat(path).st_mode & 0o777
+        umask = os.umask(0)
+        os.umask(umask)
+        assert mode == 0o666 & ~umask
+
+        # a failed export leaves the previous file untouched.
+        path = os.path.join(tmp_dir, 'r.json')
+        with open(path, 'rb') as fd:
+            content = fd.read()
+        context.add_data('bad', object())
+        with pytest.raises(TypeError):
+            context.export_json(path)
+        with open(path, 'rb') as fd:
+            assert fd.read() == content
+        assert sorted(os.listdir(tmp_dir)) == ['r.json', 'r.yaml', 'reqs.txt']
+
 def test_data():
     assert len(reproducible.data) > 0
     reproducible.data.clear()
@@ -26,4 +400,6 @@ def test_data():
 
 if __name__ == '__main__':
     test_sha256()
+    test_hash_cache()
+    test_add_files()
     test_data()
@@ -0,0 +1,59 @@
+import json
+import random
+
+import pytest
+
+import reproducible
+
+
+def test_random_state():
+    context = reproducible.Context()
+    random.seed(1)
+    context.add_random_state()
+    state = context.data['random']['state']
+    assert isinstance(state['data'], str) and len(json.dumps(state)) < 4000
+    expected = [random.random() for _ in range(10)]
+
+    random.seed(2)
+    context.restore_random_state()
+    assert [random.random() for _ in range(10)] == expected
+    # from an exported record, and from a record of older versions.
+    context.restore_random_state(json.loads(context.json()))
+    assert [random.random() for _ in range(10)] == expected
+    random.seed(1)
+    old = {'random': {'state': json.loads(json.dumps(random.getstate()))}}
+    context.restore_random_state(old)
+    assert [random.random() for _ in range(10)] == expected
+
+
+def test_numpy_random_state():
+    numpy = pytest.importorskip('numpy')
+    context = reproducible.Context()
+    numpy.random.seed(1)
+    generators = {'pcg': numpy.random.default_rng(2),
+                  'philox': numpy.random.Philox(3),
+                  'legacy': numpy.random.RandomState(4),
+                  'python': random.Random(5)}
+    context.add_random_state(generators=generators)
+    data = json.loads(context.json())
+    assert 'numpy' in data['random']
+    expected = (numpy.random.random(5).tolist(),
+                generators['pcg'].random(5).tolist(),
+                generators['philox'].random_raw(5).tolist(),
+                generators['legacy'].random_sample(5).tolist(),
+                generators['python'].random())
+
+    context.restore_random_state(data, generators=generators)
+    assert (numpy.random.random(5).tolist(),
+            generators['pcg'].random(5).tolist(),
+            generators['philox'].random_raw(5).tolist(),
+            generators['legacy'].random_sample(5).tolist(),
+            generators['python'].random()) == expected
+
+    with pytest.raises(TypeError):
+        context.add_random_state(generators={'bad': object()})
+
+
+if __name__ == '__main__':
+    test_random_state()
+    test_numpy_random_state()